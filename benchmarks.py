@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the hot paths of modmygff.
+
+Usage:
+    python benchmarks.py               # run every benchmark
+    python benchmarks.py translate     # run only the named benchmarks
+"""
+
+import argparse
+import io
+import logging
+import os
+import random
+import sys
+from timeit import Timer
+
+import gff3
+import seqkernel
+
+
+def best_of(func, number: int, repeat: int = 5) -> float:
+    """
+    Returns the best time, in seconds, of a single call to func.
+    """
+
+    return min(Timer(func).repeat(repeat=repeat, number=number)) / number
+
+
+def report(name: str, old: float, new: float):
+
+    print('{0:<32s} old {1:>10.2f} us   new {2:>10.2f} us   x{3:.1f}'.format(
+        name, old * 1e6, new * 1e6, old / new))
+
+
+def random_sequence(length: int, seed: int = 0) -> str:
+
+    rng = random.Random(seed)
+    return ''.join(rng.choice('ACGT') for _ in range(length))
+
+
+def bench_translate():
+
+    for length in (300, 3000, 30000):
+        seq = random_sequence(length)
+        number = max(1, 300000 // length)
+        report('translate %d nt' % length,
+               best_of(lambda: gff3.translate(seq), number),
+               best_of(lambda: seqkernel.translate(seq), number))
+
+
+def bench_reverse_complement():
+
+    for length in (300, 3000, 300000):
+        seq = random_sequence(length)
+        number = max(1, 3000000 // length)
+        report('reverse complement %d nt' % length,
+               best_of(lambda: gff3.complement(seq[::-1]), number),
+               best_of(lambda: seqkernel.reverse_complement(seq), number))
+
+
+def synthetic_gff(n_genes: int, seed: int = 0) -> str:
+    """
+    Returns the text of a gff with n_genes genes, each with one mRNA and two
+    exon/CDS pairs.
+    """
+
+    rng = random.Random(seed)
+    lines = ['##gff-version 3\n']
+    for g in range(n_genes):
+        seqid = 'scf%d' % (g // 1000)
+        start = (g % 1000) * 3000 + 1
+        strand = rng.choice('+-')
+        gene_id, mrna_id = 'gene%d' % g, 'mrna%d' % g
+        lines.append('%s\tEVM\tgene\t%d\t%d\t.\t%s\t.\tID=%s;Name=%s\n' % (
+            seqid, start, start + 2000, strand, gene_id, gene_id))
+        lines.append('%s\tEVM\tmRNA\t%d\t%d\t.\t%s\t.\tID=%s;Parent=%s;Name=%s\n' % (
+            seqid, start, start + 2000, strand, mrna_id, gene_id, mrna_id))
+        for e, (a, b) in enumerate(((start, start + 600), (start + 900, start + 2000))):
+            lines.append('%s\tEVM\texon\t%d\t%d\t.\t%s\t.\tID=%s.exon%d;Parent=%s\n' % (
+                seqid, a, b, strand, mrna_id, e + 1, mrna_id))
+            lines.append('%s\tEVM\tCDS\t%d\t%d\t.\t%s\t0\tID=cds.%s;Parent=%s\n' % (
+                seqid, a, b, strand, mrna_id, mrna_id))
+    return ''.join(lines)
+
+
+def parse_synthetic_gff(n_genes: int) -> gff3.Gff3:
+
+    gff3.logger.setLevel(logging.CRITICAL)
+    return gff3.Gff3(gff_file=io.StringIO(synthetic_gff(n_genes)))
+
+
+def bench_write():
+
+    gff = parse_synthetic_gff(20000)
+    n_lines = len(gff.lines)
+    with open(os.devnull, 'w') as text_out, open(os.devnull, 'wb') as binary_out:
+        for name, out, reuse_raw in (('text', text_out, False),
+                                     ('binary', binary_out, False),
+                                     ('binary, raw', binary_out, True)):
+            seconds = best_of(lambda: gff.write(out, reuse_raw=reuse_raw), 1,
+                              repeat=3)
+            print('{0:<32s} {1:>10.0f} lines/s'.format(
+                'write %d lines (%s)' % (n_lines, name), n_lines / seconds))
+
+
+def bench_to_dataframe():
+
+    import pandas as pd
+    gff = parse_synthetic_gff(20000)
+    fields = ('line_index', 'seqid', 'source', 'type', 'start', 'end', 'score',
+              'strand', 'phase')
+
+    def from_dicts():
+        rows = []
+        for line_data in gff.lines:
+            if line_data['line_type'] == 'feature':
+                row = dict((key, line_data[key]) for key in fields)
+                row['ID'] = line_data['attributes'].get('ID')
+                rows.append(row)
+        return pd.DataFrame(rows)
+
+    report('to_dataframe %d lines' % len(gff.lines),
+           best_of(from_dicts, 1, repeat=3),
+           best_of(lambda: gff.to_dataframe(attributes=('ID',)), 1, repeat=3))
+
+
+def synthetic_annotation(n_genes: int, path: str, seed: int = 0):
+    """
+    Writes a UniProt style annotation table with a hit for every other mRNA
+    of synthetic_gff(n_genes).
+    """
+
+    rng = random.Random(seed)
+    with open(path, 'w') as anno_f:
+        for g in range(0, n_genes, 2):
+            anno_f.write('mrna%d\t%s|P%05d|X_HUMAN\n' % (
+                g, rng.choice(('sp', 'tr')), g))
+
+
+def read_csv_anno_file(anno_path: str, ID_index: int, ref_index: int):
+    """
+    The former pandas loader of Modifier.open_anno_file.
+    """
+
+    import pandas as pd
+    return pd.read_csv(anno_path, engine='python', sep='\t', header=None,
+                       usecols=[ID_index, ref_index], names=["ID", "ref"],
+                       index_col="ID").astype(str)
+
+
+def bench_load_annotation():
+
+    import tempfile
+    from modmygff import Modifier
+
+    n_genes = 400000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        anno_path = os.path.join(tmp_dir, 'uniprot.tsv')
+        synthetic_annotation(n_genes, anno_path)
+        modifier = Modifier([])
+        report('load annotation %d rows' % (n_genes // 2),
+               best_of(lambda: read_csv_anno_file(anno_path, 0, 1), 1, repeat=3),
+               best_of(lambda: list(modifier.open_anno_file(anno_path, 0, 1)), 1, repeat=3))
+
+
+def bench_load_annotation_large():
+
+    import tempfile
+    import time
+    from modmygff import Modifier
+
+    n_genes = 4000000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        anno_path = os.path.join(tmp_dir, 'uniprot.tsv')
+        synthetic_annotation(n_genes, anno_path)
+        size = os.path.getsize(anno_path)
+        started = time.perf_counter()
+        Modifier([(anno_path, 0, 1)])
+        seconds = time.perf_counter() - started
+    print('{0:<32s} {1:>10.1f} MB/s   5 GB in {2:.0f} s'.format(
+        'load annotation %d MB' % (size >> 20), size / seconds / (1 << 20),
+        (5 << 30) / size * seconds))
+
+
+def bench_annotate():
+
+    import tempfile
+    from modmygff import Modifier
+
+    n_genes = 20000
+    gff = parse_synthetic_gff(n_genes)
+    ids = [line_data['attributes']['ID'] for line_data in gff.lines
+           if line_data['line_type'] == 'feature']
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        anno_path = os.path.join(tmp_dir, 'uniprot.tsv')
+        synthetic_annotation(n_genes, anno_path)
+        modifier = Modifier([(anno_path, 0, 1)])
+        anno_df = read_csv_anno_file(anno_path, 0, 1)
+
+    num_dots = 1
+
+    def loc_lookup():
+        # the former per line pandas lookup of Modifier.__getitem__
+        for index in ids:
+            try:
+                anno_row = anno_df.loc[index]
+            except KeyError:
+                if index.startswith('cds.'):
+                    index = '.'.join(index.split('.')[1:num_dots + 1])
+                else:
+                    index = '.'.join(index.split('.')[0:num_dots])
+                try:
+                    anno_row = anno_df.loc[index]
+                except KeyError:
+                    continue
+            modifier.process_accession(modifier.extract_value(anno_row, 'ref'))
+
+    report('annotate per line',
+           best_of(loc_lookup, 1, repeat=3) / len(ids),
+           best_of(lambda: modifier.resolve(ids), 1, repeat=3) / len(ids))
+
+
+def bench_join():
+
+    import tempfile
+    from modmygff import Modifier
+
+    n_genes = 200000
+    ids = []
+    for g in range(n_genes):
+        mrna_id = 'mrna%d' % g
+        ids.extend(('gene%d' % g, mrna_id, mrna_id + '.exon1', 'cds.' + mrna_id,
+                    mrna_id + '.exon2', 'cds.' + mrna_id))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        anno_path = os.path.join(tmp_dir, 'uniprot.tsv')
+        synthetic_annotation(n_genes, anno_path)
+        report('load annotation hash/join',
+               best_of(lambda: Modifier([(anno_path, 0, 1)]), 1, repeat=1),
+               best_of(lambda: Modifier([(anno_path, 0, 1)], engine='join',
+                                        tmp_dir=tmp_dir), 1, repeat=1))
+        hash_modifier = Modifier([(anno_path, 0, 1)])
+        for name, max_memory in (('memory', 512 << 20), ('spilled', 1 << 20)):
+            join_modifier = Modifier([(anno_path, 0, 1)], engine='join',
+                                     max_memory=max_memory, tmp_dir=tmp_dir)
+            report('resolve hash/join (%s)' % name,
+                   best_of(lambda: hash_modifier.resolve(ids), 1, repeat=3) / len(ids),
+                   best_of(lambda: join_modifier.resolve(ids), 1, repeat=3) / len(ids))
+
+
+BENCHMARKS = {
+    'translate': bench_translate,
+    'reverse_complement': bench_reverse_complement,
+    'write': bench_write,
+    'to_dataframe': bench_to_dataframe,
+    'annotate': bench_annotate,
+    'join': bench_join,
+    'load_annotation': bench_load_annotation,
+    'load_annotation_large': bench_load_annotation_large,
+}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Runs the modmygff "
+                                     "micro-benchmarks.")
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help='The benchmarks to run, one of %s. Default is all '
+                        'of them.' % ', '.join(sorted(BENCHMARKS)))
+
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark: %s' % name)
+    for name in args.names or sorted(BENCHMARKS):
+        BENCHMARKS[name]()
+
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -21,10 +21,12 @@ try:
 except ImportError:
     from urllib.parse import quote, unquote
 from textwrap import wrap
+import io
 import sys
 import re
 import string
 import logging
+import multiprocessing
 logger = logging.getLogger(__name__)
 #log.basicConfig(level=logging.DEBUG, format='%(levelname)-8s %(message)s')
 logger.setLevel(logging.INFO)
@@ -60,9 +62,10 @@ def translate(seq):
     return peptide
 
 
-def fasta_file_to_dict(fasta_file, id=True, header=False, seq=False):
+def fasta_file_to_dict(fasta_file, id=True, header=False, seq=False, upper=True):
     """Returns a dict from a fasta file and the number of sequences as the second return value.
     fasta_file can be a string path or a file object.
+    Sequences are upper cased unless upper is False, which keeps soft-masked (lower case) bases.
     The key of fasta_dict can be set using the keyword arguments and
     results in a combination of id, header, sequence, in that order. joined with '||'. (default: id)
     Duplicate keys are checked and a warning is logged if found.
@@ -74,7 +77,7 @@ def fasta_file_to_dict(fasta_file, id=True, header=False, seq=False):
     """
     fasta_file_f = fasta_file
     if isinstance(fasta_file, str):
-        fasta_file_f = open(fasta_file, 'rb')
+        fasta_file_f = open(fasta_file, 'r')
 
     fasta_dict = OrderedDict()
     keys = ['id', 'header', 'seq']
@@ -108,7 +111,7 @@ def fasta_file_to_dict(fasta_file, id=True, header=False, seq=False):
             entry['id'] = line.split()[0][1:]
             entry['seq'] = []
         else:
-            entry['seq'].append(line.upper())
+            entry['seq'].append(line.upper() if upper else line)
         line_num += 1
 
     if isinstance(fasta_file, str):
@@ -143,7 +146,7 @@ def fasta_dict_to_file(fasta_dict, fasta_file, line_char_limit=None):
     """
     fasta_fp = fasta_file
     if isinstance(fasta_file, str):
-        fasta_fp = open(fasta_file, 'wb')
+        fasta_fp = open(fasta_file, 'w')
 
     for key in fasta_dict:
         seq = fasta_dict[key]['seq']
@@ -154,14 +157,193 @@ def fasta_dict_to_file(fasta_dict, fasta_file, line_char_limit=None):
             fasta_dict[key]['header'], seq))
 
 
+class BufferedWriter(object):
+    """
+    Accumulates str output and writes it to a text or binary file object in chunks of about buffer_size characters,
+    str chunks are encoded when the file object is binary. Call flush() when done.
+    """
+    default_buffer_size = 1 << 20
+
+    def __init__(self, fp, buffer_size=default_buffer_size, encoding='utf-8'):
+        self.fp = fp
+        self.buffer_size = buffer_size
+        self.encoding = encoding
+        self.binary = isinstance(fp, (io.RawIOBase, io.BufferedIOBase)) or 'b' in getattr(fp, 'mode', '')
+        self.chunks = []
+        self.buffered = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.chunks:
+            chunk = ''.join(self.chunks)
+            self.fp.write(chunk.encode(self.encoding) if self.binary else chunk)
+            self.chunks = []
+            self.buffered = 0
+
+
+class FeatureSerializer(object):
+    """
+    Formats feature line_data(dict) as GFF3 lines. Attributes are written in the order of reserved_attributes followed
+    by the remaining tags in insertion order, the order is computed once per distinct sequence of attribute tags.
+    """
+    reserved_attributes = ['ID', 'Name', 'Alias', 'Parent', 'Target', 'Gap',
+                           'Derives_from', 'Note', 'geneID', 'Dbxref', 'Ontology_term', 'Is_circular']
+    line_format = '%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n'
+
+    def __init__(self):
+        self.attributes_sort_map = defaultdict(
+            int, zip(self.reserved_attributes, range(len(self.reserved_attributes), 0, -1)))
+        self.attribute_orders = {}
+
+    def attribute_order(self, tags):
+        try:
+            return self.attribute_orders[tags]
+        except KeyError:
+            order = self.attribute_orders[tags] = tuple(
+                sorted(tags, key=self.attributes_sort_map.__getitem__, reverse=True))
+            return order
+
+    def format_attributes(self, attributes):
+        attribute_list = []
+        for tag in self.attribute_order(tuple(attributes)):
+            value = attributes[tag]
+            if isinstance(value, list):
+                value = ','.join(value)
+            elif not isinstance(value, str):
+                value = str(value)
+            attribute_list.append(tag + '=' + value)
+        return ';'.join(attribute_list)
+
+    def format(self, line_data):
+        return self.line_format % (line_data['seqid'], line_data['source'], line_data['type'], line_data['start'], line_data['end'],
+                                   line_data['score'], line_data['strand'], line_data['phase'], self.format_attributes(line_data['attributes']))
+
+
+def sequence_lengths_from_file(lengths_file):
+    """Returns an OrderedDict of seqid(str) to sequence length(int) without loading any sequence.
+
+    lengths_file can be a string path to:
+    * a samtools .fai index or a chrom.sizes file, the first two tab separated columns are the seqid and the length
+    * a FASTA file, its .fai index is used when it exists, otherwise the FASTA file is scanned counting bases
+    """
+    lengths = OrderedDict()
+    with open(lengths_file, 'r') as lengths_f:
+        first_line = lengths_f.readline()
+        if not first_line.startswith('>'):
+            for line in [first_line] + [line for line in lengths_f]:
+                tokens = line.split('\t')
+                if len(tokens) >= 2 and not line.startswith('#'):
+                    lengths[tokens[0].strip()] = int(tokens[1])
+            return lengths
+    try:
+        return sequence_lengths_from_file(lengths_file + '.fai')
+    except IOError:
+        pass
+    seqid, length = None, 0
+    with open(lengths_file, 'r') as fasta_f:
+        for line in fasta_f:
+            if line.startswith('>'):
+                if seqid is not None:
+                    lengths[seqid] = length
+                seqid, length = line[1:].split()[0], 0
+            else:
+                length += len(line.strip())
+    if seqid is not None:
+        lengths[seqid] = length
+    return lengths
+
+
+def wrap_sequence(seq, line_char_limit=None):
+    """Split seq into lines of at most line_char_limit characters, None = no limit (default)"""
+    if not line_char_limit:
+        return seq
+    return '\n'.join([seq[i:i+line_char_limit] for i in range(0, len(seq), line_char_limit)])
+
+
+# state inherited by the forked shard workers, see Gff3.imap_shards
+_shard_state = {}
+
+
+def _run_shard(shard_index):
+    func, sequences, shards, args = _shard_state['job']
+    seqid, records = shards[shard_index]
+    return func(sequences[seqid], records, *args)
+
+
+def _export_shard(seq, records, kind, table, line_char_limit):
+    """Return (number of sequences, FASTA text) of one seqid shard, see Gff3.export_sequences"""
+    from seqkernel import get_codon_table, splice
+    codon_table = get_codon_table(table)
+    chunks = []
+    for line_index, transcript_id, strand, exons, cds, phase in records:
+        if kind == 'mrna':
+            spliced = splice(seq, exons, strand)
+        elif not cds:
+            continue
+        else:
+            spliced = splice(seq, cds, strand)[phase:]
+            if kind == 'protein':
+                spliced = codon_table.translate(spliced)
+        chunks.append('>%s\n%s\n' % (transcript_id, wrap_sequence(spliced, line_char_limit)))
+    return len(chunks), ''.join(chunks)
+
+
+def _check_cds_shard(seq, records, table, start_codons):
+    """Return a list of (line_index, error_info) for the CDS of one seqid shard, see Gff3.check_cds"""
+    from seqkernel import get_codon_table, splice
+    codon_table = get_codon_table(table)
+    if start_codons is None:
+        start_codons = codon_table.start_codons
+    records = [record for record in records if record[4]]
+    cds_seqs = [splice(seq, cds, strand)[phase:].upper() for line_index, transcript_id, strand, exons, cds, phase in records]
+    peptides = codon_table.translate_many(cds_seqs)
+    errors = []
+    for record, cds_seq, peptide in zip(records, cds_seqs, peptides):
+        line_index, transcript_id = record[0], record[1]
+        if len(cds_seq) % 3:
+            errors.append((line_index, {'message': 'CDS length %d of %s is not a multiple of 3' % (
+                len(cds_seq), transcript_id), 'error_type': 'CDS', 'location': 'frame'}))
+        if cds_seq[:3] not in start_codons:
+            errors.append((line_index, {'message': 'CDS of %s does not begin with a start codon: %s' % (
+                transcript_id, cds_seq[:3]), 'error_type': 'CDS', 'location': 'start_codon'}))
+        if not peptide.endswith('*'):
+            errors.append((line_index, {'message': 'CDS of %s does not end with a stop codon: %s' % (
+                transcript_id, cds_seq[3 * len(peptide) - 3:3 * len(peptide)]), 'error_type': 'CDS', 'location': 'stop_codon'}))
+        internal_stops = peptide.count('*', 0, len(peptide) - 1)
+        if internal_stops:
+            errors.append((line_index, {'message': 'CDS of %s has %d internal stop codon(s), first at codon %d' % (
+                transcript_id, internal_stops, peptide.index('*') + 1), 'error_type': 'CDS', 'location': 'internal_stop'}))
+    return errors
+
+
+def _serialize_batch(batch):
+    """Return the GFF3 text of the write items in batch(start, end), see Gff3.serialize_items"""
+    gff, items, reuse_raw = _shard_state['write']
+    serializer = FeatureSerializer()
+    chunks = []
+    for prefix, line_indexes in items[batch[0]:batch[1]]:
+        chunks.append(prefix)
+        for line_index in line_indexes:
+            chunks.append(gff.format_line(gff.lines[line_index], serializer, reuse_raw))
+    return ''.join(chunks)
+
+
 class Gff3(object):
     def __init__(self, gff_file=None, fasta_external=None, logger=logger):
         self.logger = logger
         self.lines = []
         self.features = {}
+        self.type_index = {}
         self.unresolved_parents = {}
         self.fasta_embedded = {}
         self.fasta_external = {}
+        self._prefix_sums = {}
+        self.sequence_lengths = {}
         if gff_file:
             self.parse(gff_file)
         if fasta_external:
@@ -278,16 +460,58 @@ class Gff3(object):
                 phase = (
                     3 - ((line['end'] - line['start'] + 1 - phase) % 3)) % 3
 
-    def parse_fasta_external(self, fasta_file):
-        self.fasta_external, count = fasta_file_to_dict(fasta_file)
+    def check_cds(self, transcript_types=('mRNA',), table=1, processes=None, reference=None, start_codons=('ATG',)):
+        """
+        Check the spliced CDS of every transcript for a start codon, a terminal stop codon, internal stop codons and
+        a length that is a multiple of 3, in parallel over seqid shards. Requires fasta reference.
+        The CDS is trimmed by the phase of its 5' most CDS line before checking, errors are added to the transcript line.
 
-    def check_reference(self, sequence_region=False, fasta_embedded=False, fasta_external=False, check_bounds=True, check_n=True, allowed_num_of_n=0, feature_types=('CDS',)):
+        :param transcript_types: feature types treated as transcripts (default: 'mRNA')
+        :param table: NCBI genetic code id (default: 1)
+        :param processes: number of worker processes, None = number of CPUs
+        :param reference: If None, will use self.fasta_external or self.fasta_embedded(dict)
+        :param start_codons: codons accepted as start codons, None = every start codon of table, including the
+                             alternative starts such as CTG and TTG of table 1 (default: 'ATG')
+        :return: error_lines: a set of line_index(int) with errors detected by check_cds
+        """
+        error_lines = set()
+        shards = self.spliced_segments(transcript_types)
+        if start_codons is not None:
+            start_codons = tuple(codon.upper() for codon in start_codons)
+        for errors in self.imap_shards(_check_cds_shard, shards, (table, start_codons), processes, reference):
+            for line_index, error_info in errors:
+                error_lines.add(line_index)
+                self.add_line_error(self.lines[line_index], error_info)
+        return error_lines
+
+    def parse_sequence_lengths(self, lengths_file):
+        """
+        Read the length of every reference sequence from a .fai index, a chrom.sizes file or a FASTA file,
+        see sequence_lengths_from_file. The lengths are used by write and check_reference without loading sequences.
+        """
+        self.sequence_lengths = sequence_lengths_from_file(lengths_file)
+
+    def reference_lengths(self):
+        """
+        :return: dict of seqid(str) to sequence length(int), from self.sequence_lengths, else self.fasta_external,
+                 else self.fasta_embedded
+        """
+        if self.sequence_lengths:
+            return self.sequence_lengths
+        fasta = self.fasta_external or self.fasta_embedded
+        return dict((seqid, len(fasta[seqid]['seq'])) for seqid in fasta)
+
+    def parse_fasta_external(self, fasta_file, upper=True):
+        self.fasta_external, count = fasta_file_to_dict(fasta_file, upper=upper)
+        self._prefix_sums = {}
+
+    def check_reference(self, sequence_region=False, fasta_embedded=False, fasta_external=False, sequence_lengths=False, check_bounds=True, check_n=True, allowed_num_of_n=0, feature_types=('CDS',)):
         """
         Check seqid, bounds and the number of Ns in each feature using one or more reference sources.
 
         Seqid check: check if the seqid can be found in the reference sources.
 
-        Bounds check: check the start and end fields of each features and log error if the values aren't within the seqid sequence length, requires at least one of these sources: ##sequence-region, embedded #FASTA, or external FASTA file.
+        Bounds check: check the start and end fields of each features and log error if the values aren't within the seqid sequence length, requires at least one of these sources: ##sequence-region, embedded #FASTA, external FASTA file, or sequence lengths given by self.parse_sequence_lengths.
 
         Ns check: count the number of Ns in each feature with the type specified in *line_types (default: 'CDS') and log an error if the number is greater than allowed_num_of_n (default: 0), requires at least one of these sources: embedded #FASTA, or external FASTA file.
 
@@ -298,6 +522,7 @@ class Gff3(object):
         :param sequence_region: check bounds using the ##sequence-region directive (default: False)
         :param fasta_embedded: check bounds using the embedded fasta specified by the ##FASTA directive (default: False)
         :param fasta_external: check bounds using the external fasta given by the self.parse_fasta_external (default: False)
+        :param sequence_lengths: check bounds using the sequence lengths given by the self.parse_sequence_lengths (default: False)
         :param check_bounds: If False, don't run the bounds check (default: True)
         :param check_n: If False, don't run the Ns check (default: True)
         :param allowed_num_of_n: only report features with a number of Ns greater than the specified value (default: 0)
@@ -319,7 +544,7 @@ class Gff3(object):
         n_segments_finditer = re.compile(r'[Nn]+').finditer
         # check_all_sources mode
         check_all_sources = True
-        if sequence_region or fasta_embedded or fasta_external:
+        if sequence_region or fasta_embedded or fasta_external or sequence_lengths:
             check_all_sources = False
         # get a list of line_data with valid start and end coordinates and unescape the seqid
         start_end_error_locations = set(('start', 'end', 'start,end'))
@@ -350,6 +575,25 @@ class Gff3(object):
                                         'message': 'End is greater than the ##sequence-region end: %d' % valid_sequence_regions[seqid]['end'], 'error_type': 'BOUNDS', 'location': 'sequence_region'})
         elif sequence_region:
             self.logger.debug('##sequence-region not found in GFF3')
+        # check sequence_lengths
+        unresolved_seqid = set()
+        if (check_all_sources or sequence_lengths) and self.sequence_lengths:
+            checked_at_least_one_source = True
+            for line_data, seqid in valid_line_data_seqid:
+                if seqid not in self.sequence_lengths and seqid not in unresolved_seqid:
+                    unresolved_seqid.add(seqid)
+                    error_lines.add(line_data['line_index'])
+                    self.add_line_error(line_data, {
+                                        'message': 'Seqid not found in the sequence lengths: %s' % seqid, 'error_type': 'BOUNDS', 'location': 'sequence_lengths'})
+                    continue
+                if seqid in unresolved_seqid:
+                    continue
+                if line_data['end'] > self.sequence_lengths[seqid]:
+                    error_lines.add(line_data['line_index'])
+                    self.add_line_error(line_data, {'message': 'End is greater than the sequence length: %d' % self.sequence_lengths[seqid],
+                                                    'error_type': 'BOUNDS', 'location': 'sequence_lengths'})
+        elif sequence_lengths:
+            self.logger.debug('Sequence lengths not given')
         # check fasta_embedded
         unresolved_seqid = set()
         if (check_all_sources or fasta_embedded) and self.fasta_embedded:
@@ -422,7 +666,7 @@ class Gff3(object):
             self.logger.debug('External FASTA file not given')
         if check_all_sources and not checked_at_least_one_source:
             self.logger.debug(
-                'Unable to perform bounds check, requires at least one of the following sources: ##sequence-region, embedded ##FASTA, or external FASTA file')
+                'Unable to perform bounds check, requires at least one of the following sources: ##sequence-region, embedded ##FASTA, external FASTA file, or sequence lengths')
         return error_lines
 
     def parse(self, gff_file, strict=False):
@@ -473,6 +717,8 @@ class Gff3(object):
 
         * features(dict of feature_id(str in line_data['attributes']['ID']) to feature(list of line_data(dict)))
 
+        * type_index(dict of type(str in line_data['type']) to list of line_index(int) in file order)
+
         A feature is a list of line_data(dict), since all lines that share an ID collectively represent a single feature.
 
         During serialization, line_data(dict) references should be converted into line_index(int)
@@ -509,6 +755,7 @@ class Gff3(object):
         lines = []
         current_line_num = 1  # line numbers start at 1
         features = defaultdict(list)
+        type_index = defaultdict(list)
         # key = the unresolved id, value = a list of line_data(dict)
         unresolved_parents = defaultdict(list)
 
@@ -694,6 +941,7 @@ class Gff3(object):
                         self.add_line_error(line_data, {
                                             'message': 'Source must escape the percent (%%) sign and any control characters: "%s"' % tokens[1], 'error_type': 'FORMAT', 'location': ''})
                     line_data['type'] = tokens[2]
+                    type_index[tokens[2]].append(line_data['line_index'])
                     if unescaped_field(tokens[2]):
                         self.add_line_error(line_data, {
                                             'message': 'Type must escape the percent (%%) sign and any control characters: "%s"' % tokens[2], 'error_type': 'FORMAT', 'location': ''})
@@ -901,6 +1149,7 @@ class Gff3(object):
 
         self.lines = lines
         self.features = features
+        self.type_index = type_index
         return 1
 
     def descendants(self, line_data):
@@ -991,6 +1240,7 @@ class Gff3(object):
                                 if f[0]['attributes']['ID'] != old_id]
             child['attributes']['Parent'] = [
                 d for d in child['attributes']['Parent'] if d != old_id]
+            self.mark_modified(child)
         for old_ld in old_feature:
             old_ld['children'] = []
         return children
@@ -1039,91 +1289,457 @@ class Gff3(object):
     def fix(self):
         pass
 
-    def write(self, gff_file, embed_fasta=None, fasta_char_limit=None):
-        gff_fp = gff_file
-        if isinstance(gff_file, str):
-            gff_fp = open(gff_file, 'wb')
+    def mark_modified(self, line_data):
+        """
+        Mark line_data as 'modified' so write serializes it from line_data instead of copying line_raw.
+        Call after changing the fields or attributes of a line, unless the line is 'removed'.
 
-        wrote_sequence_region = set()
-        # build sequence region data
-        sequence_regions = {}
-        if self.fasta_external:
-            for seqid in self.fasta_external:
-                sequence_regions[seqid] = (
-                    1, len(self.fasta_external[seqid]['seq']))
-        elif self.fasta_embedded:
-            for seqid in self.fasta_embedded:
-                sequence_regions[seqid] = (
-                    1, len(self.fasta_embedded[seqid]['seq']))
-        else:
-            pass
+        :param line_data: line_data(dict) with line_data['line_index'] or line_index(int)
+        """
+        try:
+            line_data['line_status']
+        except TypeError:
+            line_data = self.lines[line_data]
+        if line_data['line_status'] != 'removed':
+            line_data['line_status'] = 'modified'
 
-        wrote_lines = set()
-        field_keys = ['seqid', 'source', 'type',
-                      'start', 'end', 'score', 'strand', 'phase']
-        reserved_attributes = ['ID', 'Name', 'Alias', 'Parent', 'Target', 'Gap',
-                               'Derives_from', 'Note', 'geneID', 'Dbxref', 'Ontology_term', 'Is_circular']
-        attributes_sort_map = defaultdict(
-            int, zip(reserved_attributes, range(len(reserved_attributes), 0, -1)))
-
-        def write_feature(line_data):
-            if line_data['line_status'] == 'removed':
-                return
-            field_list = [str(line_data[k]) for k in field_keys]
-            attribute_list = []
-            for k, v in sorted(line_data['attributes'].items(), key=lambda x: attributes_sort_map[x[0]], reverse=True):
-                if isinstance(v, list):
-                    v = ','.join(v)
-                attribute_list.append('%s=%s' % (str(k), str(v)))
-            field_list.append(';'.join(attribute_list))
-            gff_fp.write('\t'.join(field_list) + '\n')
-            wrote_lines.add(line_data['line_index'])
-        # write directives
-        ignore_directives = ['##sequence-region', '###', '##FASTA']
-        directives_lines = [line_data for line_data in self.lines if line_data['line_type']
-                            == 'directive' and line_data['directive'] not in ignore_directives]
-        for directives_line in directives_lines:
-            gff_fp.write(directives_line['line_raw'])
+    @staticmethod
+    def is_clean(line_data):
+        """
+        A line is clean when its line_status is 'normal' and parsing recorded no FORMAT errors, the parsed line_data
+        then matches line_raw and the line can be written as is.
+        """
+        return line_data['line_status'] == 'normal' and not [error_info for error_info in line_data['line_errors'] if error_info['error_type'] == 'FORMAT']
 
-        # write features
+    def format_line(self, line_data, serializer, reuse_raw=False):
+        """
+        :return: the GFF3 text of a feature line_data(dict), its line_raw when clean (see is_clean) and reuse_raw is True
+        """
+        if reuse_raw and self.is_clean(line_data):
+            line_raw = line_data['line_raw']
+            return line_raw if line_raw.endswith('\n') else line_raw + '\n'
+        return serializer.format(line_data)
+
+    def root_blocks(self):
+        """
+        Group the feature lines to write into blocks, one per root feature line in file order: the lines of the root
+        feature followed by the descendants of the root line in BFS order. Removed lines and lines already in an earlier
+        block are left out, a block may be empty when all of its lines are removed.
+
+        :return: list of (root_line(dict), line_indexes(list of int))
+        """
+        blocks = []
+        wrote_lines = set()
         # get a list of root nodes
         root_lines = [line_data for line_data in self.lines if line_data['line_type']
                       == 'feature' and not line_data['parents']]
-
         for root_line in root_lines:
-            lines_wrote = len(wrote_lines)
             if root_line['line_index'] in wrote_lines:
                 continue
-            # write #sequence-region if new seqid
-            if root_line['seqid'] not in wrote_sequence_region:
-                if root_line['seqid'] in sequence_regions:
-                    gff_fp.write('##sequence-region %s %d %d\n' % (
-                        root_line['seqid'], sequence_regions[root_line['seqid']][0], sequence_regions[root_line['seqid']][1]))
-                wrote_sequence_region.add(root_line['seqid'])
             try:
                 root_feature = self.features[root_line['attributes']['ID']]
             except KeyError:
                 root_feature = [root_line]
+            line_indexes = []
             for line_data in root_feature:
-                write_feature(line_data)
-            descendants = self.descendants(root_line)
-            for descendant in descendants:
-                if descendant['line_index'] in wrote_lines:
+                if line_data['line_status'] != 'removed':
+                    line_indexes.append(line_data['line_index'])
+                    wrote_lines.add(line_data['line_index'])
+            for descendant in self.descendants(root_line):
+                if descendant['line_index'] in wrote_lines or descendant['line_status'] == 'removed':
                     continue
-                write_feature(descendant)
-            # check if we actually wrote something
-            # NOTE: check if this needs to be left in
-            # if lines_wrote != len(wrote_lines):
-            #     gff_fp.write('###\n')
+                line_indexes.append(descendant['line_index'])
+                wrote_lines.add(descendant['line_index'])
+            blocks.append((root_line, line_indexes))
+        return blocks
+
+    def write_items(self, blocks, sequence_regions=None):
+        """
+        Prefix each block with a ##sequence-region line when it starts a new seqid with a known length.
+
+        :param blocks: list of (root_line(dict), line_indexes(list of int)) in output order, see root_blocks
+        :param sequence_regions: dict of seqid to length, None = computed by reference_lengths (default)
+        :return: list of (prefix(str), line_indexes(list of int))
+        """
+        if sequence_regions is None:
+            sequence_regions = self.reference_lengths()
+        wrote_sequence_region = set()
+        items = []
+        for root_line, line_indexes in blocks:
+            prefix = ''
+            # write #sequence-region if new seqid
+            if root_line['seqid'] not in wrote_sequence_region:
+                if root_line['seqid'] in sequence_regions:
+                    prefix = '##sequence-region %s %d %d\n' % (root_line['seqid'], 1, sequence_regions[root_line['seqid']])
+                wrote_sequence_region.add(root_line['seqid'])
+            items.append((prefix, line_indexes))
+        return items
+
+    def serialize_items(self, items, reuse_raw=False, processes=1):
+        """
+        Serialize write items, see write_items, yielding the GFF3 text in order.
+
+        With processes > 1 the items are partitioned into contiguous batches of about equal line counts that are
+        serialized in forked worker processes, or in threads when the interpreter runs without the GIL, and yielded
+        in order, so the concatenated text is identical to serial mode.
+
+        :param items: list of (prefix(str), line_indexes(list of int))
+        :param reuse_raw: If True, copy the line_raw of clean lines, see is_clean (default: False)
+        :param processes: number of workers, None = number of CPUs, 1 = serialize in this process (default: 1)
+        :return: generator of str
+        """
+        processes = processes or multiprocessing.cpu_count()
+        gil_enabled = getattr(sys, '_is_gil_enabled', lambda: True)()
+        if processes <= 1 or len(items) < 2 or (gil_enabled and 'fork' not in multiprocessing.get_all_start_methods()):
+            serializer = FeatureSerializer()
+            for prefix, line_indexes in items:
+                yield prefix
+                for line_index in line_indexes:
+                    yield self.format_line(self.lines[line_index], serializer, reuse_raw)
+            return
+        # contiguous batches, several per worker to even out the load
+        total_lines = sum(len(line_indexes) for prefix, line_indexes in items)
+        batch_lines = max(1, total_lines // (processes * 4))
+        batches, batch_start, lines_in_batch = [], 0, 0
+        for i, (prefix, line_indexes) in enumerate(items):
+            lines_in_batch += len(line_indexes)
+            if lines_in_batch >= batch_lines:
+                batches.append((batch_start, i + 1))
+                batch_start, lines_in_batch = i + 1, 0
+        if batch_start < len(items):
+            batches.append((batch_start, len(items)))
+        _shard_state['write'] = (self, items, reuse_raw)
+        try:
+            if not gil_enabled:
+                from concurrent.futures import ThreadPoolExecutor
+                with ThreadPoolExecutor(processes) as executor:
+                    for text in executor.map(_serialize_batch, batches):
+                        yield text
+                return
+            pool = multiprocessing.get_context('fork').Pool(processes)
+            try:
+                for text in pool.imap(_serialize_batch, batches):
+                    yield text
+            finally:
+                pool.terminate()
+                pool.join()
+        finally:
+            _shard_state.pop('write', None)
+
+    def write(self, gff_file, embed_fasta=None, fasta_char_limit=None, buffer_size=BufferedWriter.default_buffer_size, reuse_raw=False, processes=1, sort=None):
+        """
+        Write the gff, features are written root first followed by their descendants in BFS order.
+        By default every line is serialized from line_data. With reuse_raw=True clean lines, see is_clean, are copied
+        from their line_raw instead, which is faster but relies on the caller: every line whose fields or attributes
+        were changed after parsing must be passed to mark_modified first, or the edit is silently lost.
+        With sort='coordinate' the root blocks are ordered by seqid and root start, ties keep the file order, each
+        block still starts with its root so parents precede their children.
+
+        :param gff_file: output file can be a string path or a file object opened in text or binary mode
+        :param embed_fasta: fasta_dict to embed, None = embed self.fasta_external or self.fasta_embedded, False = don't embed
+        :param fasta_char_limit: line length of the embedded fasta, None = no limit (default)
+        :param buffer_size: number of characters accumulated before each write to gff_file (default: 1 MB)
+        :param reuse_raw: If True, copy the line_raw of clean lines, see is_clean (default: False)
+        :param processes: number of workers serializing the features, see serialize_items (default: 1)
+        :param sort: None = file order (default), 'coordinate' = by seqid and start
+        """
+        if sort not in (None, 'coordinate'):
+            raise ValueError('Unknown sort order: %r, expecting None or coordinate' % sort)
+        gff_fp = gff_file
+        if isinstance(gff_file, str):
+            gff_fp = open(gff_file, 'wb')
+        out = BufferedWriter(gff_fp, buffer_size)
+
+        # write directives
+        ignore_directives = ['##sequence-region', '###', '##FASTA']
+        directives_lines = [line_data for line_data in self.lines if line_data['line_type']
+                            == 'directive' and line_data['directive'] not in ignore_directives]
+        for directives_line in directives_lines:
+            out.write(directives_line['line_raw'])
+
+        # write features
+        blocks = self.root_blocks()
+        if sort == 'coordinate':
+            blocks.sort(key=lambda block: (block[0]['seqid'], block[0]['start'] if isinstance(block[0]['start'], int) else 0))
+        items = self.write_items(blocks)
+        for text in self.serialize_items(items, reuse_raw, processes):
+            out.write(text)
+
         # write fasta
         fasta = embed_fasta or self.fasta_external or self.fasta_embedded
         if fasta and embed_fasta != False:
-            gff_fp.write('##FASTA\n')
-            fasta_dict_to_file(fasta, gff_fp, line_char_limit=fasta_char_limit)
+            out.write('##FASTA\n')
+            fasta_dict_to_file(fasta, out, line_char_limit=fasta_char_limit)
+        out.flush()
 
         if isinstance(gff_file, str):
             gff_fp.close()
 
+    def write_split(self, out_dir, by='seqid', max_per_file=None, max_open_files=8, buffer_size=BufferedWriter.default_buffer_size, reuse_raw=False, sort=None):
+        """
+        Write the root blocks to one gff file per shard in out_dir, with a manifest.tsv listing the shards.
+        Seqids are assigned to shards in the order they first appear, at most max_per_file seqids per shard.
+        Each shard starts with the header directives and the ##sequence-region lines of its seqids, no fasta is embedded.
+        The shards are written concurrently by a pool of max_open_files writer threads, which bounds the open files.
+
+        :param out_dir: output directory, created if missing
+        :param by: 'seqid', the only supported shard key
+        :param max_per_file: maximum number of seqids per shard, None = one seqid per shard (default)
+        :param max_open_files: number of writer threads, each keeps one shard file open at a time (default: 8)
+        :param buffer_size: write buffer size of each shard file (default: 1 MB)
+        :param reuse_raw: If True, copy the line_raw of clean lines, see is_clean (default: False)
+        :param sort: None = file order (default), 'coordinate' = by seqid and start, see write
+        :return: list of (file_name(str), seqids(list of str), line_count(int)) in shard order
+        """
+        import os
+        from concurrent.futures import ThreadPoolExecutor
+        if by != 'seqid':
+            raise ValueError('Unknown shard key: %r, expecting seqid' % by)
+        if sort not in (None, 'coordinate'):
+            raise ValueError('Unknown sort order: %r, expecting None or coordinate' % sort)
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        header = ''.join([line_data['line_raw'] for line_data in self.lines if line_data['line_type'] == 'directive'
+                          and line_data['directive'] not in ('##sequence-region', '###', '##FASTA')])
+        blocks = self.root_blocks()
+        if sort == 'coordinate':
+            blocks.sort(key=lambda block: (block[0]['seqid'], block[0]['start'] if isinstance(block[0]['start'], int) else 0))
+        sequence_regions = self.reference_lengths()
+        # route the blocks to shards
+        seqid_shard = {}
+        shards = []
+        for root_line, line_indexes in blocks:
+            seqid = root_line['seqid']
+            if seqid not in seqid_shard:
+                if not shards or not max_per_file or len(shards[-1][0]) >= max_per_file:
+                    shards.append(([], []))
+                seqid_shard[seqid] = shards[-1]
+                shards[-1][0].append(seqid)
+            seqid_shard[seqid][1].append((root_line, line_indexes))
+
+        def write_shard(shard_index):
+            seqids, shard_blocks = shards[shard_index]
+            file_name = 'shard_%05d.gff3' % (shard_index + 1)
+            with open(os.path.join(out_dir, file_name), 'w', buffering=buffer_size) as shard_f:
+                shard_f.write(header)
+                line_count = header.count('\n')
+                for text in self.serialize_items(self.write_items(shard_blocks, sequence_regions), reuse_raw):
+                    shard_f.write(text)
+                    line_count += text.count('\n')
+            return file_name, seqids, line_count
+
+        with ThreadPoolExecutor(max(1, max_open_files)) as executor:
+            manifest = list(executor.map(write_shard, range(len(shards))))
+        with open(os.path.join(out_dir, 'manifest.tsv'), 'w') as manifest_f:
+            manifest_f.write('#file\tseqids\tlines\n')
+            for file_name, seqids, line_count in manifest:
+                manifest_f.write('%s\t%s\t%d\n' % (file_name, ','.join(seqids), line_count))
+        return manifest
+
+    def write_gtf(self, gtf_file, transcript_types=('mRNA',), buffer_size=BufferedWriter.default_buffer_size):
+        """
+        Stream every transcript as GTF: a transcript line followed by its exon and CDS lines, with gene_id and
+        transcript_id attributes. The gene_id is the ID of the transcript's first parent, or the transcript ID when it
+        has no parent. Transcripts without exon children get one exon spanning the transcript.
+
+        :param gtf_file: output file can be a string path or a file object opened in text or binary mode
+        :param transcript_types: feature types treated as transcripts (default: 'mRNA')
+        :param buffer_size: number of characters accumulated before each write to gtf_file (default: 1 MB)
+        :return: number of transcripts written
+        """
+        gtf_fp = gtf_file
+        if isinstance(gtf_file, str):
+            gtf_fp = open(gtf_file, 'wb')
+        out = BufferedWriter(gtf_fp, buffer_size)
+        line_format = '%s\t%s\t%s\t%d\t%d\t%s\t%s\t%s\t%s\n'
+        count = 0
+        for line_data, gene, exons, cds_lines in self.transcript_models(transcript_types):
+            transcript_id = line_data['attributes'].get('ID', 'line_%d' % (line_data['line_index'] + 1))
+            gene_id = gene['attributes'].get('ID', transcript_id) if gene else transcript_id
+            attributes = 'gene_id "%s"; transcript_id "%s";' % (gene_id, transcript_id)
+            out.write(line_format % (line_data['seqid'], line_data['source'], 'transcript', line_data['start'], line_data['end'],
+                                     line_data['score'], line_data['strand'], '.', attributes))
+            for exon in exons or [line_data]:
+                out.write(line_format % (exon['seqid'], exon['source'], 'exon', exon['start'], exon['end'],
+                                         exon['score'], exon['strand'], '.', attributes))
+            for cds in cds_lines:
+                out.write(line_format % (cds['seqid'], cds['source'], 'CDS', cds['start'], cds['end'],
+                                         cds['score'], cds['strand'], cds['phase'], attributes))
+            count += 1
+        out.flush()
+        if isinstance(gtf_file, str):
+            gtf_fp.close()
+        return count
+
+    def write_bed12(self, bed_file, transcript_types=('mRNA',), buffer_size=BufferedWriter.default_buffer_size):
+        """
+        Stream every transcript as a BED12 line, blocks are the exon children (the transcript span when it has none)
+        and thickStart/thickEnd span the CDS children, both equal chromStart for non-coding transcripts.
+
+        :param bed_file: output file can be a string path or a file object opened in text or binary mode
+        :param transcript_types: feature types treated as transcripts (default: 'mRNA')
+        :param buffer_size: number of characters accumulated before each write to bed_file (default: 1 MB)
+        :return: number of transcripts written
+        """
+        bed_fp = bed_file
+        if isinstance(bed_file, str):
+            bed_fp = open(bed_file, 'wb')
+        out = BufferedWriter(bed_fp, buffer_size)
+        count = 0
+        for line_data, gene, exons, cds_lines in self.transcript_models(transcript_types):
+            blocks = [(ld['start'] - 1, ld['end']) for ld in exons] or [(line_data['start'] - 1, line_data['end'])]
+            chrom_start = blocks[0][0]
+            chrom_end = max(end for start, end in blocks)
+            if cds_lines:
+                thick_start, thick_end = cds_lines[0]['start'] - 1, max(ld['end'] for ld in cds_lines)
+            else:
+                thick_start = thick_end = chrom_start
+            out.write('%s\t%d\t%d\t%s\t0\t%s\t%d\t%d\t0\t%d\t%s,\t%s,\n' % (
+                line_data['seqid'], chrom_start, chrom_end,
+                line_data['attributes'].get('ID', 'line_%d' % (line_data['line_index'] + 1)),
+                line_data['strand'] if line_data['strand'] in ('+', '-') else '.', thick_start, thick_end, len(blocks),
+                ','.join([str(end - start) for start, end in blocks]),
+                ','.join([str(start - chrom_start) for start, end in blocks])))
+            count += 1
+        out.flush()
+        if isinstance(bed_file, str):
+            bed_fp.close()
+        return count
+
+    feature_columns_default = ('line_index', 'seqid', 'source', 'type', 'start', 'end', 'score', 'strand', 'phase')
+
+    def feature_columns(self, columns=feature_columns_default, attributes=()):
+        """
+        Collect the fields of every feature line that is not removed, in file order, into one list per column in a
+        single pass over self.lines. start, end and phase are None when not an int, score is None when not a float,
+        the pseudo column 'attributes' holds the formatted GFF3 attribute column. Every name in attributes gets its own
+        column holding the attribute value (list values comma joined) or None.
+
+        :param columns: names of the columns to collect, a subset of line_index, seqid, source, type, start, end, score,
+            strand, phase and attributes
+        :param attributes: names of the attributes to extract into their own columns, for example ('ID', 'Parent')
+        :return: OrderedDict of column name to list, columns first, then attributes
+        """
+        unknown = [name for name in columns if name not in self.feature_columns_default + ('attributes',)]
+        if unknown:
+            raise ValueError('Unknown feature column: %s' % ', '.join(unknown))
+        result = OrderedDict((name, []) for name in columns)
+        attribute_result = [(name, result.setdefault(name, [])) for name in attributes if name not in columns]
+        if len(attributes) + len(columns) != len(result):
+            raise ValueError('Attribute names must be unique and differ from the column names')
+        plain = [(name, result[name]) for name in columns if name in ('line_index', 'seqid', 'source', 'type', 'strand')]
+        ints = [(name, result[name]) for name in columns if name in ('start', 'end', 'phase')]
+        score = result.get('score') if 'score' in columns else None
+        formatted = result.get('attributes') if 'attributes' in columns else None
+        serializer = FeatureSerializer()
+        for line_data in self.lines:
+            if line_data['line_type'] != 'feature' or line_data['line_status'] == 'removed':
+                continue
+            for name, values in plain:
+                values.append(line_data[name])
+            for name, values in ints:
+                value = line_data[name]
+                values.append(value if isinstance(value, int) else None)
+            if score is not None:
+                score.append(line_data['score'] if isinstance(line_data['score'], float) else None)
+            line_attributes = line_data['attributes']
+            if formatted is not None:
+                formatted.append(serializer.format_attributes(line_attributes))
+            for name, values in attribute_result:
+                value = line_attributes.get(name)
+                values.append(','.join(value) if isinstance(value, list) else value)
+        return result
+
+    def to_dataframe(self, columns=feature_columns_default, attributes=()):
+        """
+        Build a pandas.DataFrame with one row per feature line that is not removed, in file order, from the columns
+        collected by feature_columns. seqid, source, type and strand are categorical, start, end and phase are
+        nullable Int64 and score is float64 (NaN when missing). Requires pandas.
+
+        :param columns: see feature_columns
+        :param attributes: see feature_columns
+        :return: pandas.DataFrame
+        """
+        import pandas as pd
+        data = self.feature_columns(columns, attributes)
+        for name in columns:
+            if name in ('seqid', 'source', 'type', 'strand'):
+                data[name] = pd.Categorical(data[name])
+            elif name in ('start', 'end', 'phase'):
+                data[name] = pd.array(data[name], dtype='Int64')
+            elif name == 'score':
+                data[name] = pd.array(data[name], dtype='float64')
+            elif name == 'line_index':
+                data[name] = pd.array(data[name], dtype='int64')
+        return pd.DataFrame(data, columns=list(data))
+
+    def to_numpy(self, columns=feature_columns_default, attributes=()):
+        """
+        Build a numpy structured array with one record per feature line that is not removed, in file order, from the
+        columns collected by feature_columns. line_index, start and end are int64 and phase is int8, all -1 when
+        missing, score is float64 (NaN when missing), every other field is an object (str or None). Requires numpy.
+
+        :param columns: see feature_columns
+        :param attributes: see feature_columns
+        :return: numpy.ndarray with a structured dtype
+        """
+        import numpy as np
+        data = self.feature_columns(columns, attributes)
+        dtypes = []
+        for name in data:
+            if name not in columns:
+                dtypes.append((name, object))
+            elif name in ('line_index', 'start', 'end'):
+                dtypes.append((name, np.int64))
+            elif name == 'phase':
+                dtypes.append((name, np.int8))
+            elif name == 'score':
+                dtypes.append((name, np.float64))
+            else:
+                dtypes.append((name, object))
+        n = len(next(iter(data.values()))) if data else 0
+        records = np.empty(n, dtype=dtypes)
+        for name, dtype in dtypes:
+            values = data[name]
+            if dtype is np.float64:
+                records[name] = [np.nan if value is None else value for value in values]
+            elif dtype is not object:
+                records[name] = [-1 if value is None else value for value in values]
+            else:
+                records[name] = values
+        return records
+
+    def to_arrow(self):
+        """
+        Build a pyarrow.Table with one row per feature line that is not removed, in file order. Columns: line_index,
+        seqid, source, type (dictionary encoded), start, end, score, strand, phase (null for '.' or invalid values),
+        ID, Parent (comma joined) and attributes (the GFF3 attribute column). Requires pyarrow.
+
+        :return: pyarrow.Table
+        """
+        import pyarrow as pa
+        columns = self.feature_columns(self.feature_columns_default + ('attributes',), attributes=('ID', 'Parent'))
+        types = {'line_index': pa.int64(), 'start': pa.int64(), 'end': pa.int64(), 'score': pa.float64(), 'phase': pa.int8()}
+        arrays = []
+        for name, values in columns.items():
+            if name in ('seqid', 'source', 'type', 'strand'):
+                arrays.append(pa.array(values, pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(values, types.get(name, pa.string())))
+        return pa.table(arrays, names=list(columns))
+
+    def write_parquet(self, parquet_file):
+        """
+        Write the feature table built by to_arrow as a Parquet file. Requires pyarrow.
+
+        :param parquet_file: output file can be a string path or a binary file object
+        :return: number of rows written
+        """
+        import pyarrow.parquet as pq
+        table = self.to_arrow()
+        pq.write_table(table, parquet_file)
+        return table.num_rows
+
     def sequence(self, line_data, child_type=None, reference=None):
         """
         Get the sequence of line_data, according to the columns 'seqid', 'start', 'end', 'strand'.
@@ -1155,6 +1771,257 @@ class Gff3(object):
             seq = complement(seq[::-1])
         return seq
 
+    def transcript_models(self, transcript_types=('mRNA',)):
+        """
+        Walk the hierarchy once and yield every transcript with its parent and its exon and CDS children.
+        Removed lines and lines with invalid coordinates are skipped, a transcript ID is only yielded for its first line.
+
+        :param transcript_types: feature types treated as transcripts (default: 'mRNA')
+        :return: generator of (transcript(line_data), gene(line_data or None), exons(list of line_data), cds(list of line_data)),
+                 exons and cds are sorted by start
+        """
+        transcript_types = set(transcript_types)
+        seen_ids = set()
+        for line_data in self.lines:
+            if line_data['line_type'] != 'feature' or line_data['type'] not in transcript_types or line_data['line_status'] == 'removed':
+                continue
+            if not isinstance(line_data['start'], int) or not isinstance(line_data['end'], int):
+                continue
+            transcript_id = line_data['attributes'].get('ID')
+            if transcript_id is not None:
+                if transcript_id in seen_ids:
+                    continue
+                seen_ids.add(transcript_id)
+            exons, cds_lines = [], []
+            for child in line_data['children']:
+                if child['line_status'] == 'removed' or not isinstance(child['start'], int) or not isinstance(child['end'], int):
+                    continue
+                if child['type'] == 'exon':
+                    exons.append(child)
+                elif child['type'] == 'CDS':
+                    cds_lines.append(child)
+            exons.sort(key=lambda x: x['start'])
+            cds_lines.sort(key=lambda x: x['start'])
+            gene = line_data['parents'][0][0] if line_data['parents'] else None
+            yield line_data, gene, exons, cds_lines
+
+    def spliced_segments(self, transcript_types=('mRNA',)):
+        """
+        Collect the exon and CDS segments of every transcript, grouped by seqid in the order the seqids first appear.
+        Transcripts without exon children use their own span as the single exon.
+
+        :param transcript_types: feature types treated as transcripts (default: 'mRNA')
+        :return: list of (seqid(str), records(list)), each record is a tuple of
+                 (line_index(int), transcript_id(str), strand(str), exons(list of (start, end)), cds(list of (start, end)), phase(int))
+                 segments are sorted by start, phase is the phase of the 5' most CDS
+        """
+        shards = OrderedDict()
+        for line_data, gene, exons, cds_lines in self.transcript_models(transcript_types):
+            transcript_id = line_data['attributes'].get('ID', 'line_%d' % (line_data['line_index'] + 1))
+            phase = 0
+            if cds_lines:
+                first_cds = cds_lines[-1] if line_data['strand'] == '-' else cds_lines[0]
+                if first_cds['phase'] in (1, 2):
+                    phase = first_cds['phase']
+            shards.setdefault(line_data['seqid'], []).append((
+                line_data['line_index'], transcript_id, line_data['strand'],
+                [(ld['start'], ld['end']) for ld in exons] or [(line_data['start'], line_data['end'])],
+                [(ld['start'], ld['end']) for ld in cds_lines], phase))
+        return list(shards.items())
+
+    def imap_shards(self, func, shards, args=(), processes=None, reference=None):
+        """
+        Apply func(seq, records, *args) to every (seqid, records) shard and yield the results in shard order.
+
+        The shards run in forked worker processes when more than one process is requested and fork is available,
+        the reference sequences are inherited by the workers and shared copy-on-write, only the results are pickled.
+        Shards whose seqid is not found in the reference are skipped with a warning.
+
+        :param func: a module level function
+        :param shards: list of (seqid(str), records)
+        :param args: extra positional arguments passed to func
+        :param processes: number of worker processes, None = number of CPUs, 1 = run in this process
+        :param reference: If None, will use self.fasta_external or self.fasta_embedded(dict)
+        :return: generator of func results
+        """
+        reference = reference or self.fasta_external or self.fasta_embedded
+        if not reference:
+            raise Exception('External or embedded fasta reference needed')
+        sequences = {}
+        found_shards = []
+        for seqid, records in shards:
+            entry = reference.get(seqid) or reference.get(unquote(seqid))
+            if entry is None:
+                self.logger.warning('Seqid not found in the FASTA reference, skipping %d records: %s' % (len(records), seqid))
+                continue
+            sequences[seqid] = entry['seq']
+            found_shards.append((seqid, records))
+        processes = min(processes or multiprocessing.cpu_count(), len(found_shards))
+        _shard_state['job'] = (func, sequences, found_shards, args)
+        try:
+            if processes <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+                for shard_index in range(len(found_shards)):
+                    yield _run_shard(shard_index)
+                return
+            pool = multiprocessing.get_context('fork').Pool(processes)
+            try:
+                for result in pool.imap(_run_shard, range(len(found_shards))):
+                    yield result
+            finally:
+                pool.terminate()
+                pool.join()
+        finally:
+            _shard_state.clear()
+
+    def export_sequences(self, kind, out, transcript_types=('mRNA',), table=1, line_char_limit=None, processes=None, reference=None):
+        """
+        Write the sequence of every transcript to a FASTA file, in parallel over seqid shards.
+        The output order is deterministic regardless of the number of processes: grouped by seqid in the order the
+        seqids first appear, the transcripts of each seqid in file order.
+
+        * kind='cds':  spliced CDS children, trimmed by the phase of the 5' most CDS
+        * kind='protein':  translation of the 'cds' sequence using the NCBI genetic code given by table
+        * kind='mrna':  spliced exon children, the transcript span when it has no exons
+
+        :param kind: one of 'cds', 'protein' or 'mrna'
+        :param out: output file can be a string path or a file object
+        :param transcript_types: feature types treated as transcripts (default: 'mRNA')
+        :param table: NCBI genetic code id used for 'protein' (default: 1)
+        :param line_char_limit: None = no limit (default)
+        :param processes: number of worker processes, None = number of CPUs
+        :param reference: If None, will use self.fasta_external or self.fasta_embedded(dict)
+        :return: number of sequences written
+        """
+        if kind not in ('cds', 'protein', 'mrna'):
+            raise ValueError('Unknown sequence kind: %r, expecting one of cds, protein, mrna' % kind)
+        out_fp = out
+        if isinstance(out, str):
+            out_fp = open(out, 'w')
+        count = 0
+        try:
+            shards = self.spliced_segments(transcript_types)
+            for shard_count, fasta_text in self.imap_shards(_export_shard, shards, (kind, table, line_char_limit), processes, reference):
+                out_fp.write(fasta_text)
+                count += shard_count
+        finally:
+            if isinstance(out, str):
+                out_fp.close()
+        return count
+
+    def prefix_sums(self, seqid, reference=None, cache=False):
+        """
+        Prefix sums of the G+C, N and lower case (soft-masked) base counts of a reference sequence, case insensitive
+        for G, C and N. The count of a 1-based, inclusive [start, end] range is sums[end] - sums[start - 1].
+        Use parse_fasta_external(fasta_file, upper=False) to keep soft-masking. The sums take 12 bytes per base (24 for
+        sequences of 4 Gb or more), so they are only kept when cache is True.
+
+        :param seqid: seqid(str) of the reference sequence
+        :param reference: If None, will use self.fasta_external or self.fasta_embedded(dict), an explicit reference
+            bypasses the cache
+        :param cache: keep the sums of self.fasta_external or self.fasta_embedded for later calls (default: False)
+        :return: (gc(numpy array), n(numpy array), lower(numpy array)), each of length len(seq) + 1
+        """
+        import numpy as np
+        if reference is None:
+            try:
+                return self._prefix_sums[seqid]
+            except KeyError:
+                pass
+        else:
+            cache = False
+        reference = reference or self.fasta_external or self.fasta_embedded
+        if not reference:
+            raise Exception('External or embedded fasta reference needed')
+        seq = (reference.get(seqid) or reference[unquote(seqid)])['seq']
+        bases = np.frombuffer(seq.encode('ascii'), dtype=np.uint8)
+        dtype = np.uint32 if len(bases) < 2 ** 32 else np.uint64
+        folded = bases | 0x20  # lower case
+        prefix_sums = []
+        for mask in ((folded == ord('g')) | (folded == ord('c')), folded == ord('n'), (bases >= ord('a')) & (bases <= ord('z'))):
+            sums = np.zeros(len(bases) + 1, dtype=dtype)
+            np.cumsum(mask, dtype=dtype, out=sums[1:])
+            prefix_sums.append(sums)
+        prefix_sums = tuple(prefix_sums)
+        if cache:
+            self._prefix_sums[seqid] = prefix_sums
+        return prefix_sums
+
+    def feature_stats(self, types=('gene', 'exon'), reference=None):
+        """
+        GC content, N content and soft-masked fraction of every feature, computed in O(1) per feature from the
+        prefix sums of each seqid, see prefix_sums. The sums of one seqid are held at a time.
+
+        gc_fraction is relative to the number of non-N bases, n_fraction and soft_masked_fraction to the feature length.
+        Features with invalid coordinates or a seqid missing from the reference are skipped.
+
+        :param types: only include features of these types, None = all features (default: 'gene', 'exon')
+        :param reference: If None, will use self.fasta_external or self.fasta_embedded(dict)
+        :return: pandas.DataFrame with one row per feature, columns: line_index, seqid, type, ID, start, end, length,
+                 gc_count, n_count, soft_masked_count, gc_fraction, n_fraction, soft_masked_fraction
+        """
+        import numpy as np
+        import pandas as pd
+        reference = reference or self.fasta_external or self.fasta_embedded
+        if not reference:
+            raise Exception('External or embedded fasta reference needed')
+        types = set(types) if types is not None else None
+        by_seqid = OrderedDict()
+        for line_data in self.lines:
+            if line_data['line_type'] != 'feature' or line_data['line_status'] == 'removed' or (types is not None and line_data['type'] not in types):
+                continue
+            if not isinstance(line_data['start'], int) or not isinstance(line_data['end'], int):
+                continue
+            by_seqid.setdefault(line_data['seqid'], []).append(line_data)
+        columns = defaultdict(list)
+        for seqid, seqid_lines in by_seqid.items():
+            if seqid not in reference and unquote(seqid) not in reference:
+                self.logger.warning('Seqid not found in the FASTA reference, skipping %d features: %s' % (len(seqid_lines), seqid))
+                continue
+            gc, n, lower = self.prefix_sums(seqid, reference)
+            starts = np.fromiter((ld['start'] for ld in seqid_lines), dtype=np.int64, count=len(seqid_lines))
+            ends = np.fromiter((ld['end'] for ld in seqid_lines), dtype=np.int64, count=len(seqid_lines))
+            # clip to the sequence, out of bounds features are reported by check_reference
+            ends = np.minimum(ends, len(gc) - 1)
+            starts = np.minimum(np.maximum(starts, 1), ends + 1)
+            columns['line_index'].extend(ld['line_index'] for ld in seqid_lines)
+            columns['seqid'].extend([seqid] * len(seqid_lines))
+            columns['type'].extend(ld['type'] for ld in seqid_lines)
+            columns['ID'].extend(ld['attributes'].get('ID', '') for ld in seqid_lines)
+            columns['start'].append(starts)
+            columns['end'].append(ends)
+            for name, sums in (('gc_count', gc), ('n_count', n), ('soft_masked_count', lower)):
+                columns[name].append(sums[ends].astype(np.int64) - sums[starts - 1])
+            del gc, n, lower
+        table = pd.DataFrame({
+            'line_index': np.array(columns['line_index'], dtype=np.int64),
+            'seqid': pd.Categorical(columns['seqid']),
+            'type': pd.Categorical(columns['type']),
+            'ID': columns['ID'],
+        })
+        for name in ('start', 'end', 'gc_count', 'n_count', 'soft_masked_count'):
+            table[name] = np.concatenate(columns[name]) if columns[name] else np.zeros(0, dtype=np.int64)
+        length = table['end'] - table['start'] + 1
+        table.insert(6, 'length', length)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            table['gc_fraction'] = table['gc_count'] / (length - table['n_count'])
+            table['n_fraction'] = table['n_count'] / length
+            table['soft_masked_fraction'] = table['soft_masked_count'] / length
+        return table
+
+    def lines_of_type(self, types):
+        """
+        Get the feature lines of the given types from type_index, without visiting the other lines.
+
+        :param types: a feature type(str) or an iterable of feature types
+        :return: list of line_data(dict) in file order
+        """
+        if isinstance(types, str):
+            types = (types,)
+        line_indexes = [line_index for t in set(types) for line_index in self.type_index.get(t, ())]
+        if len(types) > 1:
+            line_indexes.sort()
+        return [self.lines[line_index] for line_index in line_indexes]
+
     def type_tree(self):
         class node(object):
             def __init__(self, value, children=None):
@@ -0,0 +1,189 @@
+"""
+Disk-backed coordinate sort of gff files that do not fit in memory.
+
+The gff is streamed once and cut into blocks, a block starts at every feature
+line without a Parent attribute and holds the lines that follow it up to the
+next such line, so parents stay in front of their children as long as the input
+lists children after their root (which `Gff3.write` guarantees). Blocks are
+buffered up to a memory budget, sorted by (seqid, start) and spilled to
+temporary run files, the runs are then combined with a k-way merge. Directives
+and comments before the first feature are written first, `###` directives are
+dropped and a `##FASTA` section is copied to the end of the output.
+"""
+
+import heapq
+import os
+import pickle
+import shutil
+import tempfile
+from operator import itemgetter
+
+__all__ = ['sort_gff', 'write_run', 'read_run', 'merge_runs', 'reduce_runs']
+
+DEFAULT_MAX_MEMORY = 512 << 20
+MAX_OPEN_RUNS = 64
+
+
+def block_key(line: str, ordinal: int) -> tuple:
+    """
+    Returns the sort key of the block starting with the given feature line,
+    ties are broken by ordinal, the position of the block in the input.
+    """
+
+    tokens = line.split('\t', 4)
+    try:
+        start = int(tokens[3])
+    except (IndexError, ValueError):
+        start = 0
+    return tokens[0], start, ordinal
+
+
+def is_root(line: str) -> bool:
+    """
+    Returns True if the feature line has no Parent attribute.
+    """
+
+    attributes = line.rstrip('\n').rsplit('\t', 1)[-1]
+    return not (attributes.startswith('Parent=') or ';Parent=' in attributes)
+
+
+def write_run(blocks, tmp_dir: str) -> str:
+    """
+    Pickles sorted (key, text) blocks one by one to a new run file, blocks may
+    be any iterable so merged runs are streamed straight to disk.
+
+    Returns:
+        Returns the path of the run file.
+    """
+
+    fd, run_path = tempfile.mkstemp(suffix='.run', dir=tmp_dir)
+    with os.fdopen(fd, 'wb') as run_f:
+        for block in blocks:
+            pickle.dump(block, run_f, pickle.HIGHEST_PROTOCOL)
+    return run_path
+
+
+def read_run(run_path: str):
+    """
+    Yields the (key, text) blocks of a run file in order.
+    """
+
+    with open(run_path, 'rb') as run_f:
+        while True:
+            try:
+                yield pickle.load(run_f)
+            except EOFError:
+                return
+
+
+def merge_runs(run_paths: list):
+    """
+    Yields the (key, text) blocks of sorted run files in key order.
+    """
+
+    return heapq.merge(*[read_run(run_path) for run_path in run_paths],
+                       key=itemgetter(0))
+
+
+def reduce_runs(run_paths: list, tmp_dir: str) -> list:
+    """
+    Merges groups of consecutive run files into new run files until at most
+    MAX_OPEN_RUNS remain, which bounds the number of files merge_runs opens.
+    Merged runs are removed, equal keys keep the order of the runs.
+
+    Returns:
+        Returns the paths of the remaining run files, in order.
+    """
+
+    while len(run_paths) > MAX_OPEN_RUNS:
+        merged_paths = []
+        for i in range(0, len(run_paths), MAX_OPEN_RUNS):
+            group = run_paths[i:i + MAX_OPEN_RUNS]
+            if len(group) == 1:
+                merged_paths.append(group[0])
+                continue
+            merged_paths.append(write_run(merge_runs(group), tmp_dir))
+            for run_path in group:
+                os.remove(run_path)
+        run_paths = merged_paths
+    return run_paths
+
+
+def sort_gff(gff_path: str, out, max_memory: int = DEFAULT_MAX_MEMORY,
+             tmp_dir: str = None) -> int:
+    """
+    Sorts a gff file by seqid and start, keeping every root feature together
+    with its descendants.
+
+    Parameters:
+        gff_path:
+            A path to the gff file.
+
+        out:
+            A text file object to write the sorted gff to.
+
+        max_memory:
+            The approximate number of characters of blocks held in memory
+            before they are spilled to a run file.
+
+        tmp_dir:
+            The directory of the temporary run files. The default is the
+            system temporary directory.
+
+    Returns:
+        Returns the number of blocks written.
+    """
+
+    work_dir = tempfile.mkdtemp(prefix='gffsort.', dir=tmp_dir)
+    try:
+        header, blocks, run_paths = [], [], []
+        current_key, current_lines = None, []
+        buffered = ordinal = 0
+        fasta_path = None
+
+        with open(gff_path, 'r') as gff_f:
+            for line in gff_f:
+                if line.startswith('##FASTA'):
+                    fasta_path = os.path.join(work_dir, 'fasta')
+                    with open(fasta_path, 'w') as fasta_f:
+                        fasta_f.write(line)
+                        shutil.copyfileobj(gff_f, fasta_f)
+                    break
+                if line.startswith('###'):
+                    continue
+                if line.startswith('#') or not line.strip():
+                    if current_key is None:
+                        header.append(line)
+                    else:
+                        current_lines.append(line)
+                    continue
+                if current_key is None or is_root(line):
+                    if current_key is not None:
+                        blocks.append((current_key, ''.join(current_lines)))
+                    current_key, current_lines = block_key(line, ordinal), []
+                    ordinal += 1
+                    if buffered >= max_memory:
+                        blocks.sort(key=itemgetter(0))
+                        run_paths.append(write_run(blocks, work_dir))
+                        blocks, buffered = [], 0
+                current_lines.append(line)
+                buffered += len(line)
+        if current_key is not None:
+            blocks.append((current_key, ''.join(current_lines)))
+
+        out.write(''.join(header))
+        blocks.sort(key=itemgetter(0))
+        if run_paths:
+            run_paths.append(write_run(blocks, work_dir))
+            blocks = merge_runs(reduce_runs(run_paths, work_dir))
+        for key, text in blocks:
+            out.write(text)
+
+        if fasta_path is not None:
+            with open(fasta_path, 'r') as fasta_f:
+                shutil.copyfileobj(fasta_f, out)
+
+        return ordinal
+
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
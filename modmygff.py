@@ -4,13 +4,507 @@ __author__ = 'Michael Ciccotosto-Camp'
 __version__ = ''
 
 import argparse
+import os
+import queue
+import re
+import shutil
 import sys
-from functools import lru_cache
+import tempfile
+import threading
+import time
+import weakref
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from operator import itemgetter
+
+from gff3 import FeatureSerializer, Gff3
+from gffsort import (DEFAULT_MAX_MEMORY, merge_runs, reduce_runs, sort_gff,
+                     write_run)
+from tqdm import tqdm
 
-import pandas as pd
+ID_PATTERN = re.compile(r'(?:^|;)ID=([^;]*)')
 
-from gff3 import Gff3
-from tqdm import tqdm
+_MISSING = object()
+_UNHANDLED = object()
+
+
+# the strings pandas.read_csv reads as missing values
+NA_VALUES = frozenset(['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN',
+                       '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA',
+                       'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'])
+
+
+# name: (pattern, formatter), see register_accession_processor
+ACCESSION_PROCESSORS = OrderedDict()
+
+
+def register_accession_processor(name: str, pattern: str, formatter):
+    """
+    Registers a processor turning the accessions of an annotation file into
+    Dbxref values.
+
+    Parameters:
+        name:
+            The name selecting the processor on the command line, a valid
+            Python identifier.
+
+        pattern:
+            A regular expression matched at the start of the accession. Its
+            named groups, if any, must be prefixed with name followed by an
+            underscore.
+
+        formatter:
+            Either a format string, called with the text matched by pattern
+            as {0} and the named groups as keywords, or a function of the
+            re.Match returning the Dbxref value.
+    """
+
+    if not name.isidentifier():
+        raise ValueError('Accession processor names must be identifiers: '
+                         '{0}'.format(name))
+
+    ACCESSION_PROCESSORS[name] = (pattern, formatter)
+
+
+register_accession_processor(
+    'uniprot', r'(?P<uniprot_db>sp|tr)\|(?P<uniprot_id>[^|]*)',
+    lambda match: '{0}:{1}'.format(
+        'UniProtKB/Swiss-Prot' if match.group('uniprot_db') == 'sp'
+        else 'UniProtKB/TrEMBL', match.group('uniprot_id').strip()))
+register_accession_processor('pfam', r'PF.*', 'PFAM:{0}')
+register_accession_processor('pfam_clan', r'CL\d{4}', 'Pfam-clan:{0}')
+register_accession_processor('interpro', r'IPR\d{6}', 'InterPro:{0}')
+register_accession_processor('go', r'GO:\d{7}', '{0}')
+register_accession_processor('kegg', r'(?:ko:)?(?P<kegg_id>K\d{5})',
+                             'KEGG:{kegg_id}')
+register_accession_processor('eggnog', r'(?P<eggnog_id>(?:COG|KOG|ENOG)\w+)',
+                             'eggNOG:{eggnog_id}')
+
+DEFAULT_ACCESSION_PROCESSORS = ('uniprot', 'pfam')
+
+
+class AccessionDispatcher:
+    """
+    Processes accessions with a set of registered accession processors.
+
+    The patterns of the processors are compiled into a single alternation, so
+    an accession is dispatched with one regular expression match, the first
+    processor in the given order whose pattern matches wins.
+    """
+
+    def __init__(self, names=DEFAULT_ACCESSION_PROCESSORS):
+        """
+        Creates a new dispatcher.
+
+        Parameters:
+            names:
+                The names of the registered processors to use, in order.
+        """
+
+        unknown = [name for name in names if name not in ACCESSION_PROCESSORS]
+        if unknown:
+            raise ValueError('Unknown accession processor: {0}, expecting one '
+                             'of {1}'.format(', '.join(unknown),
+                                             ', '.join(ACCESSION_PROCESSORS)))
+
+        self.names = tuple(names)
+        self.formatters = {name: ACCESSION_PROCESSORS[name][1]
+                           for name in self.names}
+        self.pattern = re.compile('|'.join(
+            '(?P<{0}>{1})'.format(name, ACCESSION_PROCESSORS[name][0])
+            for name in self.names), re.DOTALL)
+
+    def process(self, accession: str) -> str:
+        """
+        Returns the Dbxref value of an accession.
+
+        Raises:
+            NotImplementedError if no processor matches the accession.
+        """
+
+        match = self.pattern.match(accession)
+
+        if match is None:
+            raise NotImplementedError(
+                "Not equipped to handle db xref (" + accession + ")")
+
+        # the processor groups enclose their named groups, so the processor
+        # group is always the last one closed
+        name = match.lastgroup
+        formatter = self.formatters[name]
+
+        if isinstance(formatter, str):
+            return formatter.format(match.group(name), **match.groupdict())
+
+        return formatter(match)
+
+
+class LookupCache:
+    """
+    A bounded cache of lookup results with hit, miss and eviction counters.
+
+    Entries are evicted in least recently used ('lru') or insertion ('fifo')
+    order once capacity is reached. After min_lookups lookups the cache turns
+    itself off if its hit rate is below min_hit_rate, since a cache that
+    rarely hits only adds overhead.
+    """
+
+    POLICIES = ('lru', 'fifo')
+
+    def __init__(self, capacity: int = 65536, policy: str = 'lru',
+                 min_hit_rate: float = 0.05, min_lookups: int = 10000):
+        """
+        Creates a new cache.
+
+        Parameters:
+            capacity:
+                The maximum number of entries, 0 disables the cache.
+
+            policy:
+                The eviction policy, 'lru' or 'fifo'.
+
+            min_hit_rate:
+                The hit rate below which the cache disables itself, 0 keeps
+                it enabled.
+
+            min_lookups:
+                The number of lookups after which the hit rate is checked.
+        """
+
+        if policy not in self.POLICIES:
+            raise ValueError('Unknown cache policy: {0}'.format(policy))
+
+        self.capacity = capacity
+        self.policy = policy
+        self.min_hit_rate = min_hit_rate
+        self.min_lookups = min_lookups
+        self.enabled = capacity > 0
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, compute):
+        """
+        Returns the cached value of key, calling compute(key) on a miss.
+        """
+
+        if not self.enabled:
+            return compute(key)
+
+        entries = self._entries
+        try:
+            value = entries[key]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            if self.policy == 'lru':
+                entries.move_to_end(key)
+            return value
+
+        self.misses += 1
+        value = entries[key] = compute(key)
+        if len(entries) > self.capacity:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+        if (self.min_hit_rate and self.hits + self.misses == self.min_lookups
+                and self.hits < self.min_hit_rate * self.min_lookups):
+            self.enabled = False
+            entries.clear()
+
+        return value
+
+    def summary(self) -> str:
+        """
+        Returns a one line report of the cache counters.
+        """
+
+        lookups = self.hits + self.misses
+        return ('Lookup cache ({0}, capacity {1}{2}): {3} hits, {4} misses, '
+                '{5} evictions, hit rate {6:.1%}'.format(
+                    self.policy, self.capacity,
+                    '' if self.enabled else ', disabled', self.hits,
+                    self.misses, self.evictions,
+                    self.hits / lookups if lookups else 0.0))
+
+
+class AnnotationSource:
+    """
+    The compiled contents of one annotation file together with the rule
+    deriving its keys from gff feature IDs.
+
+    A feature ID is looked up as is first. If it is missing, the key is
+    derived by dropping a known prefix (such as the cds. of CDS IDs) and
+    keeping the first num_dots + 1 dot separated components, where num_dots
+    is by default the most common number of dots among the IDs of the table.
+    """
+
+    def __init__(self, path: str, anno_map: dict, num_dots: int = None,
+                 strip_prefixes: tuple = ('cds.',)):
+        """
+        Creates a new annotation source.
+
+        Parameters:
+            path:
+                The path of the annotation file.
+
+            anno_map:
+                A dict of ID to the tuple of processed Dbxref values, see
+                Modifier.compile_anno_map.
+
+            num_dots:
+                The number of dots of the derived keys. The default is
+                inferred from the IDs of anno_map.
+
+            strip_prefixes:
+                Prefixes dropped from feature IDs when deriving keys.
+        """
+
+        self.path = path
+        self.anno_map = anno_map
+        self.strip_prefixes = tuple(strip_prefixes)
+
+        if num_dots is None:
+            dot_counts = Counter(ID.count('.') for ID in anno_map)
+            num_dots = dot_counts.most_common(1)[0][0] if dot_counts else 0
+        self.num_dots = num_dots
+
+    def derive_key(self, feature_id: str) -> str:
+        """
+        Returns the annotation key derived from a feature ID.
+        """
+
+        for prefix in self.strip_prefixes:
+            if feature_id.startswith(prefix):
+                feature_id = feature_id[len(prefix):]
+                break
+
+        return '.'.join(feature_id.split('.', self.num_dots + 1)[:self.num_dots + 1])
+
+    def resolve_keys(self, feature_ids) -> dict:
+        """
+        Resolves many feature IDs at once.
+
+        Returns:
+            Returns a dict of feature ID to the key of anno_map it is
+            annotated by, feature IDs without a key are left out.
+        """
+
+        anno_map = self.anno_map
+        keys = {ID: ID for ID in feature_ids if ID in anno_map}
+        missing = [ID for ID in feature_ids if ID not in keys]
+        derived = zip(missing, map(self.derive_key, missing))
+        keys.update((ID, key) for ID, key in derived if key in anno_map)
+
+        return keys
+
+    def resolve(self, feature_ids) -> dict:
+        """
+        Resolves many feature IDs at once.
+
+        Returns:
+            Returns a dict of feature ID to the tuple of Dbxref values of its
+            key, feature IDs without a key are left out.
+        """
+
+        anno_map = self.anno_map
+
+        return {ID: anno_map[key]
+                for ID, key in self.resolve_keys(feature_ids).items()}
+
+    def get(self, feature_id: str):
+        """
+        Returns the tuple of Dbxref values of a single feature ID, empty if it
+        has none.
+        """
+
+        accessions = self.anno_map.get(feature_id, _MISSING)
+        if accessions is _MISSING:
+            accessions = self.anno_map.get(self.derive_key(feature_id), ())
+
+        return accessions
+
+
+class SortedAnnotationSource(AnnotationSource):
+    """
+    The contents of one annotation file sorted by ID, matched with gff
+    feature IDs by a sort-merge join instead of dict lookups.
+
+    The rows are sorted in runs of at most max_memory characters, runs that
+    do not fit are spilled to temporary files and combined with a k-way merge
+    (see gffsort), so the table never has to fit in memory. The sorted table
+    is then scanned in chunks and the sorted feature IDs and derived keys are
+    matched against each chunk with numpy.searchsorted. Keys are derived as
+    by AnnotationSource.
+    """
+
+    def __init__(self, path: str, anno_rows, num_dots: int = None,
+                 strip_prefixes: tuple = ('cds.',),
+                 max_memory: int = DEFAULT_MAX_MEMORY, tmp_dir: str = None,
+                 chunk_size: int = 1 << 16):
+        """
+        Creates a new sorted annotation source.
+
+        Parameters:
+            path:
+                The path of the annotation file.
+
+            anno_rows:
+                An iterable of the (ID, Dbxref value) rows of the annotation
+                file in file order, the value is None when the row has no
+                usable reference, see Modifier.process_rows.
+
+            num_dots:
+                The number of dots of the derived keys. The default is
+                inferred from the IDs of anno_rows.
+
+            strip_prefixes:
+                Prefixes dropped from feature IDs when deriving keys.
+
+            max_memory:
+                The approximate number of characters of rows held in memory
+                before they are spilled to a run file.
+
+            tmp_dir:
+                The directory of the temporary files. The default is the
+                system temporary directory.
+
+            chunk_size:
+                The number of IDs of the sorted table matched at a time.
+        """
+
+        self.path = path
+        self.anno_map = None
+        self.strip_prefixes = tuple(strip_prefixes)
+        self.chunk_size = chunk_size
+        self._keys = self._values = self._table_path = None
+
+        work_dir = tempfile.mkdtemp(prefix='modmygff.', dir=tmp_dir)
+        # the sorted table lives as long as the source
+        self._cleanup = weakref.finalize(self, shutil.rmtree, work_dir, True)
+
+        rows, run_paths = [], []
+        buffered = 0
+        for ordinal, (ID, accession) in enumerate(anno_rows):
+            rows.append((ID, ordinal, accession))
+            buffered += len(ID) + len(accession or '')
+            if buffered >= max_memory:
+                rows.sort(key=itemgetter(0))
+                run_paths.append(write_run(rows, work_dir))
+                rows, buffered = [], 0
+        rows.sort(key=itemgetter(0))
+
+        # the first row of every ID is its first in the file, which breaks
+        # ties of the dot counts like Counter.most_common on anno_map
+        dot_counts = {}
+
+        def grouped(sorted_rows):
+            current, first, accessions = None, 0, []
+            for ID, ordinal, accession in sorted_rows:
+                if ID != current:
+                    if current is not None:
+                        yield current, first, tuple(accessions)
+                    current, first, accessions = ID, ordinal, []
+                if accession is not None and accession not in accessions:
+                    accessions.append(accession)
+            if current is not None:
+                yield current, first, tuple(accessions)
+
+        def counted(groups):
+            for ID, first, accessions in groups:
+                dots = ID.count('.')
+                count = dot_counts.get(dots)
+                dot_counts[dots] = (1, first) if count is None else (
+                    count[0] + 1, count[1])
+                yield ID, accessions
+
+        if run_paths:
+            run_paths.append(write_run(rows, work_dir))
+            del rows
+            self._table_path = os.path.join(work_dir, 'table.tsv')
+            with open(self._table_path, 'w', buffering=1 << 20) as table_f:
+                for ID, accessions in counted(grouped(
+                        merge_runs(reduce_runs(run_paths, work_dir)))):
+                    table_f.write('\t'.join((ID,) + accessions) + '\n')
+            for run_path in os.listdir(work_dir):
+                if run_path.endswith('.run'):
+                    os.remove(os.path.join(work_dir, run_path))
+        else:
+            self._keys, self._values = [], []
+            for ID, accessions in counted(grouped(rows)):
+                self._keys.append(ID)
+                self._values.append(accessions)
+            del rows
+
+        if num_dots is None:
+            num_dots = min(dot_counts.items(),
+                           key=lambda item: (-item[1][0], item[1][1]))[0] \
+                if dot_counts else 0
+        self.num_dots = num_dots
+
+    def chunks(self):
+        """
+        Yields the sorted table as (keys, values) chunks in key order, keys
+        is a numpy array of IDs and values the list of their tuples of
+        Dbxref values.
+        """
+
+        import numpy as np
+
+        if self._table_path is None:
+            if self._keys:
+                yield np.array(self._keys, dtype=str), self._values
+            return
+
+        with open(self._table_path, 'r', buffering=1 << 20) as table_f:
+            while True:
+                rows = [line.rstrip('\n').split('\t')
+                        for _, line in zip(range(self.chunk_size), table_f)]
+                if not rows:
+                    return
+                yield (np.array([row[0] for row in rows], dtype=str),
+                       [tuple(row[1:]) for row in rows])
+
+    def resolve(self, feature_ids) -> dict:
+        """
+        Resolves many feature IDs at once with one scan of the sorted table,
+        see AnnotationSource.resolve.
+        """
+
+        import numpy as np
+
+        feature_ids = list(feature_ids)
+        derived = list(map(self.derive_key, feature_ids))
+        # sorting the python strings is faster than numpy.unique on them
+        query = np.array(sorted(set(feature_ids).union(derived)), dtype=str)
+
+        found = {}
+        for keys, values in self.chunks():
+            # the query keys within the range of the chunk
+            start = np.searchsorted(query, keys[0], side='left')
+            end = np.searchsorted(query, keys[-1], side='right')
+            if start == end:
+                continue
+            matched = query[start:end]
+            positions = np.searchsorted(keys, matched)
+            hits = keys[positions] == matched
+            found.update(zip(matched[hits].tolist(),
+                             map(values.__getitem__, positions[hits].tolist())))
+
+        resolved = {ID: found[ID] for ID in feature_ids if ID in found}
+        resolved.update((ID, found[key]) for ID, key in zip(feature_ids, derived)
+                        if key in found and ID not in resolved)
+
+        return resolved
+
+    def get(self, feature_id: str):
+        """
+        Returns the tuple of Dbxref values of a single feature ID, empty if it
+        has none. Every call scans the sorted table, use resolve for many
+        feature IDs.
+        """
+
+        return self.resolve([feature_id]).get(feature_id, ())
 
 
 class Modifier:
@@ -19,7 +513,12 @@ class Modifier:
     modify a gff file.
     """
 
-    def __init__(self, anno_file: list):
+    ENGINES = ('hash', 'join')
+
+    def __init__(self, anno_file: list, header: bool = False,
+                 cache: LookupCache = None, strict: bool = False,
+                 engine: str = 'hash', max_memory: int = DEFAULT_MAX_MEMORY,
+                 tmp_dir: str = None):
         """
         Creates a new instance of a gff modifier.
 
@@ -30,62 +529,229 @@ class Modifier:
             anno_delimiter:
                 The delimiter for the annotation file. The default is a
                 single tab.
+
+            header:
+                If True, the first line of every annotation file that is not
+                a comment is a header and is skipped.
+
+            cache:
+                The LookupCache of single ID lookups. The default is a
+                LookupCache with default settings.
+
+            strict:
+                If True, raise NotImplementedError listing every reference
+                that cannot be processed once all files are loaded. Otherwise
+                those rows are skipped and collected in self.unhandled.
+
+            engine:
+                'hash' compiles every annotation file into a dict
+                (AnnotationSource), 'join' sorts it on disk and matches the
+                feature IDs with a sort-merge join (SortedAnnotationSource),
+                for annotation files larger than memory.
+
+            max_memory:
+                With engine 'join', the approximate number of characters of
+                annotation rows sorted in memory before they are spilled to
+                a temporary file.
+
+            tmp_dir:
+                With engine 'join', the directory of the temporary files. The
+                default is the system temporary directory.
+
+        Every entry of anno_file is (path, ID_index, ref_index) optionally
+        followed by the accession processor names of the file, a comma
+        separated str or a list. The default is uniprot and pfam.
         """
 
-        self.__anno_dfs = []
+        if engine not in self.ENGINES:
+            raise ValueError('Unknown engine: {0}'.format(engine))
 
-        self._num_df_dots = None
+        self.sources = []
+        self.cache = LookupCache() if cache is None else cache
+        # path of the annotation file to a Counter of unhandled references
+        self.unhandled = {}
 
-        for path, ID_index, ref_index in anno_file:
+        for path, ID_index, ref_index, *processors in anno_file:
 
             ID_index = int(ID_index)
             ref_index = int(ref_index)
 
-            open_anno_kwargs = {"anno_path": path,
-                                "ID_index": ID_index, "ref_index": ref_index}
-
-            anno_df = self.open_anno_file(**open_anno_kwargs)
+            names = DEFAULT_ACCESSION_PROCESSORS
+            if processors:
+                names = processors[0]
+                if isinstance(names, str):
+                    names = names.split(',')
+            dispatcher = AccessionDispatcher(names)
+
+            open_anno_kwargs = {"anno_path": path, "ID_index": ID_index,
+                                "ref_index": ref_index, "header": header}
+
+            anno_rows = self.open_anno_file(**open_anno_kwargs)
+
+            unhandled = Counter()
+            if engine == 'join':
+                self.sources.append(SortedAnnotationSource(
+                    path, self.process_rows(anno_rows, unhandled, dispatcher),
+                    max_memory=max_memory, tmp_dir=tmp_dir))
+            else:
+                self.sources.append(AnnotationSource(
+                    path, self.compile_anno_map(anno_rows, unhandled,
+                                                dispatcher)))
+            if unhandled:
+                self.unhandled[path] = unhandled
+
+        if strict and self.unhandled:
+            raise NotImplementedError(self.unhandled_report())
+
+    def unhandled_report(self, limit: int = 5) -> str:
+        """
+        Returns a report of the references that could not be processed, at
+        most limit examples per annotation file, empty if there are none.
+        """
 
-            anno_df = anno_df[~anno_df.index.duplicated(keep='first')]
+        report = []
 
-            self.__anno_dfs.append(anno_df)
+        for path, unhandled in self.unhandled.items():
+            examples = ', '.join(ref for ref, _ in unhandled.most_common(limit))
+            report.append("{0} rows of {1} hold {2} db xrefs the modifier "
+                          "is not equipped to handle, e.g. {3}".format(
+                              sum(unhandled.values()), path, len(unhandled),
+                              examples))
 
-            self._num_df_dots = len(
-                list(filter(lambda c: c == '.', anno_df.index[0]))) + 1
+        return '\n'.join(report)
 
-    @lru_cache()
     def __getitem__(self, index: str) -> str:
         """
         Returns the corresponding extended information for the given index.
         """
 
+        return self.cache.get(index, self.lookup)
+
+    def lookup(self, index: str) -> list:
+        """
+        Looks the given index up in every annotation source, bypassing the
+        cache.
+        """
+
         return_list = []
 
-        for df in self.__anno_dfs:
+        for source in self.sources:
 
-            try:
-                anno_row = df.loc[index]
+            for accession in source.get(index):
+                return_list.append(("Dbxref", accession))
+
+        return return_list
+
+    def resolve(self, feature_ids) -> dict:
+        """
+        Resolves the extended information of many feature IDs in one pass per
+        annotation source.
+
+        Returns:
+            Returns a dict of feature ID to the list of ("Dbxref", accession)
+            pairs in the order of feature_ids, feature IDs without any are
+            left out.
+        """
+
+        feature_ids = list(dict.fromkeys(feature_ids))
+        updates = {}
+
+        for source in self.sources:
+
+            for ID, accessions in source.resolve(feature_ids).items():
+
+                if accessions:
+                    updates.setdefault(ID, []).extend(
+                        ("Dbxref", accession) for accession in accessions)
+
+        return {ID: updates[ID] for ID in feature_ids if ID in updates}
+
+    def compile_anno_map(self, anno_rows, unhandled: Counter = None,
+                         dispatcher: AccessionDispatcher = None) -> dict:
+        """
+        Compiles an iterable of the (ID, ref) rows of an annotation file,
+        grouped by ID in a single pass over the rows, into a dict from ID to
+        the tuple of its processed Dbxref values. Duplicates are dropped
+        keeping the order of first appearance, the tuple is empty when no row
+        of the ID has a usable reference.
+
+        Every distinct reference is processed once, with dispatcher (by
+        default the uniprot and pfam processors). References that cannot be
+        processed are skipped and counted in unhandled.
+
+        Raises:
+            NotImplementedError if a reference cannot be processed and
+            unhandled is None.
+        """
+
+        anno_map = {}
+        processed = {None: None}
 
-            except KeyError:
+        for ID, ref in anno_rows:
 
-                if index.startswith('cds.'):
-                    index = '.'.join(index.split('.')[1:self._num_df_dots + 1])
-                else:
-                    index = '.'.join(index.split('.')[0:self._num_df_dots])
+            accession = processed.get(ref, _MISSING)
 
+            if accession is _MISSING:
                 try:
-                    # Get the corresponding row in the annotation file
-                    anno_row = df.loc[index]
-                except KeyError:
-                    continue
+                    accession = self.normalize_accession(ref, dispatcher)
+                except NotImplementedError:
+                    if unhandled is None:
+                        raise
+                    accession = _UNHANDLED
+                processed[ref] = accession
 
-            accession = self.extract_value(anno_row, "ref")
+            if accession is _UNHANDLED:
+                unhandled[ref] += 1
+                accession = None
 
-            if accession is not None:
-                accession = self.process_accession(accession)
-                return_list.append(("Dbxref", accession))
+            accessions = anno_map.get(ID)
 
-        return return_list
+            if accessions is None:
+                anno_map[ID] = () if accession is None else (accession,)
+
+            elif accession is not None and accession not in accessions:
+                anno_map[ID] = accessions + (accession,)
+
+        return anno_map
+
+    def process_rows(self, anno_rows, unhandled: Counter = None,
+                     dispatcher: AccessionDispatcher = None):
+        """
+        Processes the (ID, ref) rows of an annotation file one at a time, like
+        compile_anno_map but without grouping them, so the rows never have to
+        fit in memory. Processed references are kept in a LookupCache, which
+        turns itself off when references rarely repeat.
+
+        Returns:
+            Yields (ID, Dbxref value) tuples in file order, the value is None
+            when the row has no usable reference.
+
+        Raises:
+            NotImplementedError if a reference cannot be processed and
+            unhandled is None.
+        """
+
+        def process(ref):
+            if ref is None:
+                return None
+            try:
+                return self.normalize_accession(ref, dispatcher)
+            except NotImplementedError:
+                if unhandled is None:
+                    raise
+                return _UNHANDLED
+
+        processed = LookupCache()
+
+        for ID, ref in anno_rows:
+
+            accession = processed.get(ref, process)
+
+            if accession is _UNHANDLED:
+                unhandled[ref] += 1
+                accession = None
+
+            yield ID, accession
 
     def list_to_dict(self, input_list: list):
 
@@ -98,25 +764,104 @@ class Modifier:
 
         return new_dict
 
-    def modify_gff(self, gff: Gff3):
+    def line_updates(self, gff: Gff3, types=None,
+                     propagate: bool = False) -> dict:
+        """
+        Resolves the extended information of the feature lines of a Gff3
+        object, see modify_gff for the parameters.
+
+        Returns:
+            Returns a dict of line index to the list of ("Dbxref", accession)
+            pairs, in file order, lines without any are left out.
+        """
+
+        if types is None:
+            selected = [line for line in gff.lines if line['line_type'] == 'feature'
+                        and 'ID' in line['attributes']]
+        else:
+            selected = [line for line in gff.lines_of_type(types)
+                        if 'ID' in line['attributes']]
+
+        updates = self.resolve(line['attributes']['ID'] for line in selected)
+
+        line_updates = {}
+
+        for line in selected:
+
+            update_list = updates.get(line['attributes']['ID'])
+            if not update_list:
+                continue
+
+            targets = [line]
+            if propagate:
+                targets.extend(gff.descendants(line))
+
+            for target in targets:
+                target_list = line_updates.setdefault(target['line_index'], [])
+                target_list.extend(u for u in update_list if u not in target_list)
+
+        return {line_index: line_updates[line_index]
+                for line_index in sorted(line_updates)}
+
+    def modify_gff(self, gff: Gff3, types=None, propagate: bool = False):
         """
         Modifies an existing Gff3 object by adding contents from the input
         annotation file.
+
+        Parameters:
+            gff:
+                The Gff3 object to modify.
+
+            types:
+                The feature types whose IDs are looked up, for example
+                ('mRNA',). The default is every feature line. Lines without
+                an ID are never looked up.
+
+            propagate:
+                If True, the Dbxref values found for a line are also added to
+                all of its descendants, whether or not they have an ID.
         """
 
-        for line in tqdm(iterable=gff.lines, desc='Modify Compilation', ascii=True):
+        updates = self.line_updates(gff, types, propagate)
 
-            # Get the ID to use to index on this modifier
-            gene_ID = line['attributes']['ID']
-            update_list = self[gene_ID]
+        for line_index, update_list in tqdm(iterable=updates.items(),
+                                            desc='Modify Compilation', ascii=True):
 
+            line = gff.lines[line_index]
             line['attributes'].update(self.list_to_dict(update_list))
+            gff.mark_modified(line)
 
         return
 
-    def open_anno_file(self, anno_path: str = None, ID_index: int = 0, ref_index: int = 1):
+    def compute_delta(self, gff: Gff3, types=None) -> dict:
+        """
+        Collects the Dbxref values modify_gff would add to the given Gff3
+        object without modifying it, see modify_gff for the parameters.
+        Deltas are keyed by feature ID, so propagation to descendants, which
+        may lack an ID, is not supported.
+
+        Returns:
+            Returns a dict of feature ID to the list of added Dbxref values,
+            in file order.
+        """
+
+        delta = {}
+
+        for line_index, update_list in self.line_updates(
+                gff, types).items():
+
+            ID = gff.lines[line_index]['attributes']['ID']
+            if ID not in delta:
+                delta[ID] = self.list_to_dict(update_list)['Dbxref']
+
+        return delta
+
+    def open_anno_file(self, anno_path: str = None, ID_index: int = 0, ref_index: int = 1,
+                       header: bool = False):
         """
-        Opens the annotations file.
+        Opens the annotations file. The file is streamed line by line and only
+        the two needed tab separated columns are kept, lines starting with #
+        and empty lines are skipped.
 
         Parameters:
             anno_path:
@@ -128,17 +873,39 @@ class Modifier:
             ref_index:
                 The reference index to the corresponding annotation file.
 
+            header:
+                If True, the first line that is not a comment is skipped.
+
         Return:
-            Returns a 2-column pandas dataframe with the first column being
-            the gene ID and the second column being the reference index.
+            Yields (ID, ref) tuples in file order, ref is None when the column
+            is missing or holds a missing value such as NA. Rows without an ID
+            are dropped.
         """
 
-        anno_df = pd.read_csv(anno_path, engine='python',
-                              sep='\t', header=None, usecols=[ID_index, ref_index], names=["ID", "ref"], index_col="ID").astype(str)
+        max_split = max(ID_index, ref_index) + 1
+
+        with open(anno_path, 'r', buffering=1 << 20) as anno_f:
+            for line in anno_f:
+
+                if line.startswith('#'):
+                    continue
+
+                if header:
+                    header = False
+                    continue
+
+                columns = line.rstrip('\r\n').split('\t', max_split)
+
+                if len(columns) <= ID_index or columns[ID_index] in NA_VALUES:
+                    continue
+
+                ref = columns[ref_index] if len(columns) > ref_index else None
+                if ref in NA_VALUES:
+                    ref = None
 
-        return anno_df
+                yield columns[ID_index], ref
 
-    def extract_value(self, anno_row: pd.Series, value: str) -> str:
+    def extract_value(self, anno_row: dict, value: str) -> str:
         """
         Extracts a certain value from a certain row of the annotation file.
 
@@ -173,46 +940,497 @@ class Modifier:
 
         return extracted_value
 
-    def process_accession(self, accession: str) -> str:
+    def normalize_accession(self, ref: str,
+                            dispatcher: AccessionDispatcher = None) -> str:
         """
-        Processes the accession value from the annotation file.
+        Extracts and processes the accession of a raw reference value, see
+        extract_value and process_accession.
+
+        Returns:
+            Returns the Dbxref value, None if ref holds no reference.
         """
 
-        if accession.startswith("tr|") or accession.startswith("sp|"):
+        accession = self.extract_value({"ref": ref}, "ref")
+
+        if accession is None:
+            return None
+
+        return self.process_accession(accession, dispatcher)
+
+    def process_accession(self, accession: str,
+                          dispatcher: AccessionDispatcher = None) -> str:
+        """
+        Processes the accession value from the annotation file with the given
+        AccessionDispatcher, by default the uniprot and pfam processors.
+        """
+
+        if dispatcher is None:
+            dispatcher = _default_dispatcher()
+
+        return dispatcher.process(accession)
+
+
+def _default_dispatcher() -> AccessionDispatcher:
+
+    global _DEFAULT_DISPATCHER
+    if _DEFAULT_DISPATCHER is None:
+        _DEFAULT_DISPATCHER = AccessionDispatcher()
+    return _DEFAULT_DISPATCHER
+
+
+_DEFAULT_DISPATCHER = None
+
+
+FSYNC_POLICIES = ('none', 'file', 'full')
+
+
+@contextmanager
+def atomic_output(path: str, buffer_size: int = 1 << 20, fsync: str = 'none'):
+    """
+    Opens a temporary file next to path for writing and renames it over path
+    once the block completes, so readers never see a partially written file.
+    The temporary file is removed if the block raises.
+
+    Parameters:
+        path:
+            The final path of the output file.
+
+        buffer_size:
+            The buffer size, in bytes, of the temporary file.
+
+        fsync:
+            'none' only renames, 'file' fsyncs the temporary file before the
+            rename and 'full' also fsyncs the directory after the rename.
+    """
+
+    if fsync not in FSYNC_POLICIES:
+        raise ValueError('Unknown fsync policy: {0}'.format(fsync))
+
+    out_dir = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        prefix='.{0}.'.format(os.path.basename(path)), suffix='.tmp', dir=out_dir)
+    started = time.perf_counter()
+
+    try:
+        with os.fdopen(fd, 'w', buffering=buffer_size) as file_out:
+            yield file_out
+            file_out.flush()
+            if fsync != 'none':
+                os.fsync(file_out.fileno())
+
+        # mkstemp creates the file as 0600, use the mode open() would give it
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    if fsync == 'full':
+        dir_fd = os.open(out_dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    elapsed = time.perf_counter() - started
+    print("Wrote {0} bytes to {1} in {2:.2f} s ({3:.1f} MB/s)".format(
+        size, path, elapsed, size / max(elapsed, 1e-9) / (1 << 20)),
+        file=sys.stderr)
+
+
+def write_delta(delta: dict, out):
+    """
+    Writes a delta as a two column TSV of feature ID and the comma separated
+    Dbxref values to add. Applying it with apply_delta gives the same
+    features and Dbxref values as the full gff output, see apply_delta for
+    the differences.
+    """
+
+    out.write('#ID\tDbxref\n')
+    for feature_id, values in delta.items():
+        out.write('{0}\t{1}\n'.format(feature_id, ','.join(values)))
+
+
+def read_delta(delta_path: str, delta: dict = None) -> dict:
+    """
+    Reads a delta written by write_delta, values of IDs already in delta are
+    extended so several deltas can be stacked.
+
+    Returns:
+        Returns a dict of feature ID to the list of Dbxref values to add.
+    """
+
+    if delta is None:
+        delta = {}
+
+    with open(delta_path, 'r') as delta_f:
+        for line in delta_f:
+            if line.startswith('#') or not line.strip():
+                continue
+            feature_id, values = line.rstrip('\r\n').split('\t', 1)
+            merged = delta.setdefault(feature_id, [])
+            merged.extend(v for v in values.split(',') if v not in merged)
+
+    return delta
+
+
+def merge_dbxref(attribute_column: str, values: list,
+                 serializer: FeatureSerializer, replace: bool = False) -> str:
+    """
+    Adds Dbxref values to a GFF3 attribute column, values already present are
+    skipped and the attributes are written in the order used by Gff3.write.
+    If replace is True any existing Dbxref values are dropped first, as
+    Modifier.modify_gff does.
+
+    Returns:
+        Returns the new attribute column.
+    """
+
+    attributes = {}
+    if attribute_column != '.':
+        for token in attribute_column.split(';'):
+            if token:
+                tag, _, value = token.partition('=')
+                attributes[tag] = value
+
+    dbxref = []
+    if attributes.get('Dbxref') and not replace:
+        dbxref = attributes['Dbxref'].split(',')
+    dbxref.extend(v for v in values if v not in dbxref)
+    attributes['Dbxref'] = dbxref
+
+    return serializer.format_attributes(attributes)
+
+
+_END = object()
+
+
+def stream_gff(gff_in, out, lookup, replace: bool = False, types=None,
+               queue_size: int = 16, chunk_size: int = 1 << 20) -> int:
+    """
+    Streams a gff file from gff_in to out, adding Dbxref values to every
+    feature line with an ID. Reading, annotating and writing run in three
+    stages connected by bounded queues: a reader thread, the calling thread
+    and a writer thread, so I/O overlaps the annotation. Lines other than
+    features, and everything from a ##FASTA directive on, are copied
+    unchanged.
+
+    Every line keeps its position and line ending (\n or \r\n). Unlike
+    Gff3.write, the lines are not regrouped into root-first blocks with the
+    descendants in BFS order, and ##sequence-region and ### directives are
+    kept. The output therefore holds the same features and Dbxref values as
+    the in-memory path, but it is not byte-identical when a feature has
+    several children with their own children, such as a gene with two
+    isoforms.
+
+    Parameters:
+        gff_in:
+            A text file object to read the gff file from.
+
+        out:
+            A text file object to write the modified gff file to.
+
+        lookup:
+            A function of the feature ID returning the list of Dbxref values
+            to add, or an empty list or None.
+
+        replace:
+            See merge_dbxref.
+
+        types:
+            The feature types whose IDs are looked up. The default is every
+            feature line.
+
+        queue_size:
+            The number of chunks each queue holds before blocking.
+
+        chunk_size:
+            The approximate number of characters read per chunk.
+
+    Returns:
+        Returns the number of modified lines.
+    """
+
+    read_queue = queue.Queue(queue_size)
+    write_queue = queue.Queue(queue_size)
+    errors = []
+    # set when the annotating thread stops, so the reader never blocks on a
+    # full read_queue nobody drains any more
+    stopped = threading.Event()
+
+    def put_read(item) -> bool:
+        while not stopped.is_set():
+            try:
+                read_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        try:
+            while True:
+                lines = gff_in.readlines(chunk_size)
+                if not lines or not put_read(lines):
+                    break
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            put_read(_END)
+
+    def writer():
+        failed = False
+        while True:
+            chunk = write_queue.get()
+            if chunk is _END:
+                break
+            if failed:
+                # keep draining so the annotating thread never blocks
+                continue
+            try:
+                out.write(chunk)
+            except BaseException as e:
+                errors.append(e)
+                failed = True
+        if not failed:
+            try:
+                out.flush()
+            except BaseException as e:
+                errors.append(e)
+
+    reader_thread = threading.Thread(target=reader, daemon=True)
+    writer_thread = threading.Thread(target=writer, daemon=True)
+    reader_thread.start()
+    writer_thread.start()
+
+    serializer = FeatureSerializer()
+    modified = 0
+    in_fasta = False
+
+    try:
+        while True:
+            lines = read_queue.get()
+            # stop early once the reader or the writer failed, for example
+            # with a broken pipe, instead of annotating the rest of gff_in
+            if lines is _END or errors:
+                break
+
+            if not in_fasta:
+                for i, line in enumerate(lines):
+                    if line.startswith('#') or not line.strip():
+                        if line.startswith('##FASTA'):
+                            in_fasta = True
+                            break
+                        continue
+
+                    content = line.rstrip('\r\n')
+                    columns = content.split('\t')
+                    if len(columns) != 9 or (types is not None
+                                             and columns[2] not in types):
+                        continue
+                    feature_id = ID_PATTERN.search(columns[8])
+                    if feature_id is None:
+                        continue
+                    values = lookup(feature_id.group(1))
+                    if values:
+                        columns[8] = merge_dbxref(
+                            columns[8], values, serializer, replace=replace)
+                        lines[i] = '\t'.join(columns) + (
+                            line[len(content):] or '\n')
+                        modified += 1
+
+            write_queue.put(''.join(lines))
+
+    finally:
+        # the reader may still be blocked reading gff_in, it is a daemon
+        # thread and exits on its own once stopped is set
+        stopped.set()
+        write_queue.put(_END)
+        writer_thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return modified
+
+
+def apply_delta(gff_path: str, delta: dict, out) -> int:
+    """
+    Streams a gff file to out, adding the Dbxref values of the delta to every
+    feature line whose ID is in the delta. Other lines, and everything from a
+    ##FASTA directive on, are copied unchanged.
+
+    The result is equivalent to the gff file written by run_modifier, but not
+    byte-identical to it. The lines keep their file order and directives,
+    see stream_gff, and Dbxref values already in the gff file are kept rather
+    than replaced.
 
-            db_xref_prefix, db_xref_id, *_ = accession.split(sep='|')
+    Returns:
+        Returns the number of modified lines.
+    """
 
-            db_xref_prefix, db_xref_id = db_xref_prefix.strip(), db_xref_id.strip()
+    with open(gff_path, 'r') as gff_f:
+        return stream_gff(gff_f, out, delta.get)
 
-            if db_xref_prefix == "sp":
-                return 'UniProtKB/Swiss-Prot:{0}'.format(db_xref_id)
-            elif db_xref_prefix == "tr":
-                return 'UniProtKB/TrEMBL:{0}'.format(db_xref_id)
 
-        elif accession.startswith("PF"):
-            return 'PFAM:{0}'.format(accession)
+def run_stream_modifier(args, modifier: Modifier):
 
-        raise NotImplementedError(
-            "Not equipped to handle db xref (" + accession + ")")
+    def lookup(feature_id):
+        return [value for _, value in modifier[feature_id]]
+
+    print("Streaming gff file", file=sys.stderr)
+    if args.output_path is None:
+        count = stream_gff(sys.stdin, sys.stdout, lookup, replace=True,
+                           types=args.feature_types)
+    else:
+        with atomic_output(args.output_path, args.buffer_size << 10,
+                           args.fsync) as file_out:
+            count = stream_gff(sys.stdin, file_out, lookup, replace=True,
+                               types=args.feature_types)
+    print("Modified {0} lines".format(count), file=sys.stderr)
+    print(modifier.cache.summary(), file=sys.stderr)
 
 
 def run_modifier(args):
 
-    modifier = Modifier(args.annotation)
-    print("Reading gff file")
+    cache = LookupCache(capacity=args.cache_size, policy=args.cache_policy,
+                        min_hit_rate=args.cache_min_hit_rate)
+    modifier = Modifier(args.annotation, header=args.annotation_header,
+                        cache=cache, strict=args.strict, engine=args.engine,
+                        max_memory=args.max_memory << 20, tmp_dir=args.tmp_dir)
+    if modifier.unhandled:
+        print("Skipping unhandled rows:\n" + modifier.unhandled_report(),
+              file=sys.stderr)
+    if args.gff_path == '-':
+        return run_stream_modifier(args, modifier)
+
+    print("Reading gff file", file=sys.stderr)
     gff: Gff3 = Gff3(gff_file=args.gff_path)
+    if args.chrom_sizes is not None:
+        gff.parse_sequence_lengths(args.chrom_sizes)
+
+    if args.emit == 'delta':
+        delta = modifier.compute_delta(gff, types=args.feature_types)
+
+        print("Writing delta file", file=sys.stderr)
+        if args.output_path is None:
+            write_delta(delta, sys.stdout)
+        else:
+            with atomic_output(args.output_path, args.buffer_size << 10,
+                               args.fsync) as file_out:
+                write_delta(delta, file_out)
+        return
 
     # Modify the gff file using the Modifier class
-    modifier.modify_gff(gff)
+    modifier.modify_gff(gff, types=args.feature_types,
+                        propagate=args.propagate)
+
+    print("Writing modified gff file", file=sys.stderr)
+    # Write the modified gff to the output path, modify_gff marks every line
+    # it changes so the unchanged lines can be copied verbatim
+    if args.split_dir is not None:
+        manifest = gff.write_split(args.split_dir, max_per_file=args.max_per_file,
+                                   max_open_files=args.max_open_files,
+                                   buffer_size=args.buffer_size << 10,
+                                   reuse_raw=True, sort=args.sort)
+        print("Wrote {0} shards to {1}".format(len(manifest), args.split_dir),
+              file=sys.stderr)
+
+    elif args.output_path is None:
+        gff.write(sys.stdout, reuse_raw=True, processes=args.processes,
+                  sort=args.sort)
+
+    else:
+        with atomic_output(args.output_path, args.buffer_size << 10,
+                           args.fsync) as file_out:
+            gff.write(file_out, buffer_size=args.buffer_size << 10,
+                      reuse_raw=True, processes=args.processes, sort=args.sort)
+
+
+def run_export(args):
+
+    print("Reading gff file", file=sys.stderr)
+    gff: Gff3 = Gff3(gff_file=args.gff_path, fasta_external=args.fasta_path)
+
+    print("Writing {0} sequences".format(args.kind), file=sys.stderr)
+    output = sys.stdout if args.output_path is None else args.output_path
+    count = gff.export_sequences(args.kind, output,
+                                 transcript_types=args.transcript_types.split(','),
+                                 table=args.table, line_char_limit=args.line_length,
+                                 processes=args.processes)
+    print("Wrote {0} sequences".format(count), file=sys.stderr)
+
+
+def run_stats(args):
 
-    print("Writing modified gff file")
-    # Write the modified gff to the output path
+    print("Reading gff file", file=sys.stderr)
+    gff: Gff3 = Gff3(gff_file=args.gff_path)
+    gff.parse_fasta_external(args.fasta_path, upper=False)
+
+    print("Computing feature statistics", file=sys.stderr)
+    stats = gff.feature_stats(types=args.types.split(',') if args.types else None)
+
+    if args.format == 'parquet':
+        if args.output_path is None:
+            raise ValueError("--output_path is required for parquet output")
+        stats.to_parquet(args.output_path, index=False)
+    else:
+        stats.to_csv(sys.stdout if args.output_path is None else args.output_path,
+                     sep='\t', index=False)
+
+
+def run_sort(args):
+
+    print("Sorting gff file", file=sys.stderr)
     if args.output_path is None:
-        gff.write(sys.stdout)
+        count = sort_gff(args.gff_path, sys.stdout,
+                         max_memory=args.max_memory << 20, tmp_dir=args.tmp_dir)
+    else:
+        with open(args.output_path, "w") as file_out:
+            count = sort_gff(args.gff_path, file_out,
+                             max_memory=args.max_memory << 20, tmp_dir=args.tmp_dir)
+    print("Sorted {0} blocks".format(count), file=sys.stderr)
+
 
+def run_convert(args):
+
+    print("Reading gff file", file=sys.stderr)
+    gff: Gff3 = Gff3(gff_file=args.gff_path)
+
+    print("Writing {0} file".format(args.format), file=sys.stderr)
+    transcript_types = args.transcript_types.split(',')
+    if args.format == 'parquet':
+        if args.output_path is None:
+            raise ValueError("--output_path is required for parquet output")
+        count = gff.write_parquet(args.output_path)
+    else:
+        write = gff.write_gtf if args.format == 'gtf' else gff.write_bed12
+        count = write(sys.stdout if args.output_path is None else args.output_path,
+                      transcript_types=transcript_types)
+    print("Wrote {0} records".format(count), file=sys.stderr)
+
+
+def run_apply_delta(args):
+
+    delta = {}
+    for delta_path in args.delta_path:
+        read_delta(delta_path, delta)
+
+    print("Applying delta to gff file", file=sys.stderr)
+    if args.output_path is None:
+        count = apply_delta(args.gff_path, delta, sys.stdout)
     else:
         with open(args.output_path, "w") as file_out:
-            gff.write(file_out)
+            count = apply_delta(args.gff_path, delta, file_out)
+    print("Modified {0} lines".format(count), file=sys.stderr)
 
 
 def main():
@@ -226,18 +1444,250 @@ def main():
     parser = argparse.ArgumentParser(description="Creates a flat file from a "
                                      "given gff file and annotations file.")
 
-    parser.add_argument('--gff_path', type=str, required=True,
-                        help='A file path to the gff file.')
-    parser.add_argument('--annotation', action='append', nargs=3, required=True,
-                        metavar=('path', 'index_col', 'ref_col'),
-                        help="A file path to the annotation file.")
+    parser.add_argument('--gff_path', type=str, required=False,
+                        help='A file path to the gff file, - streams it from '
+                        'stdin.')
+    parser.add_argument('--annotation', action='append', nargs='+',
+                        required=False,
+                        metavar=('path', 'index_col ref_col [processors]'),
+                        help="A file path to the annotation file, the ID and "
+                        "reference columns and optionally a comma separated "
+                        "list of the accession processors of the file, from "
+                        "{0}. The default processors are {1}.".format(
+                            ', '.join(ACCESSION_PROCESSORS),
+                            ','.join(DEFAULT_ACCESSION_PROCESSORS)))
+    parser.add_argument('--annotation_header', action='store_true',
+                        help='The first line of every annotation file that is '
+                        'not a # comment is a header line.')
 
     parser.add_argument('--output_path', type=str, required=False, default=None,
                         help='A file path to output the contents of the flatfile. '
-                        'Default output file is stdout.')
+                        'Default output file (or -) is stdout.')
+    parser.add_argument('--chrom_sizes', '--chrom-sizes', type=str,
+                        required=False, default=None,
+                        help='A .fai index, chrom.sizes or FASTA file giving '
+                        'the sequence lengths used to write the '
+                        '##sequence-region lines.')
+    parser.add_argument('--processes', type=int, required=False, default=1,
+                        help='The number of worker processes serializing the '
+                        'modified gff file. The default is 1.')
+    parser.add_argument('--sort', choices=('coordinate',), required=False,
+                        default=None,
+                        help='Order the gene blocks of the modified gff file '
+                        'by seqid and start. The default is the input order.')
+    parser.add_argument('--split_dir', type=str, required=False, default=None,
+                        help='Write the modified gff as one file per seqid '
+                        'shard, plus a manifest.tsv, to this directory instead '
+                        'of --output_path.')
+    parser.add_argument('--max_per_file', type=int, required=False, default=None,
+                        help='The maximum number of seqids per shard file with '
+                        '--split_dir. The default is one seqid per file.')
+    parser.add_argument('--max_open_files', type=int, required=False, default=8,
+                        help='The number of shard files written concurrently '
+                        'with --split_dir. The default is 8.')
+    parser.add_argument('--emit', choices=('gff', 'delta'), required=False,
+                        default='gff',
+                        help='Write the modified gff file, or only a delta '
+                        'file of the added Dbxref values per feature ID, to '
+                        'be merged later with the apply-delta command. The '
+                        'default is gff.')
+    parser.add_argument('--buffer_size', '--buffer-size', type=int,
+                        required=False, default=1024,
+                        help='The output buffer size in KB. The default is '
+                        '1024.')
+    parser.add_argument('--fsync', choices=FSYNC_POLICIES, required=False,
+                        default='none',
+                        help='The output is written to a temporary file and '
+                        'renamed over --output_path when complete. file '
+                        'fsyncs the file before the rename, full also fsyncs '
+                        'the directory. The default is none.')
+    parser.add_argument('--strict', action='store_true',
+                        help='Fail when an annotation file holds db xrefs the '
+                        'modifier cannot handle. By default those rows are '
+                        'skipped and reported.')
+    parser.add_argument('--feature_types', '--feature-types', type=str,
+                        required=False, default=None,
+                        help='A comma separated list of the feature types to '
+                        'annotate, for example mRNA. The default is every '
+                        'feature with an ID.')
+    parser.add_argument('--propagate', action='store_true',
+                        help='Also add the Dbxref values of every annotated '
+                        'feature to all of its descendants.')
+    parser.add_argument('--engine', choices=Modifier.ENGINES, required=False,
+                        default='hash',
+                        help='How gff IDs are matched to the annotation '
+                        'files: hash loads every file into a dict, join sorts '
+                        'it on disk and matches the sorted IDs in one scan, '
+                        'for annotation files larger than memory. The default '
+                        'is hash.')
+    parser.add_argument('--max_memory', type=int, required=False, default=512,
+                        help='With --engine join, the MB of annotation text '
+                        'sorted in memory before spilling to a temporary '
+                        'file, the memory used is a few times larger. The '
+                        'default is 512.')
+    parser.add_argument('--tmp_dir', type=str, required=False, default=None,
+                        help='The directory of the temporary files of '
+                        '--engine join. The default is the system temporary '
+                        'directory.')
+    parser.add_argument('--cache_size', type=int, required=False,
+                        default=65536,
+                        help='The number of IDs whose annotations are cached '
+                        'when streaming from stdin, 0 disables the cache. The '
+                        'default is 65536.')
+    parser.add_argument('--cache_policy', choices=LookupCache.POLICIES,
+                        required=False, default='lru',
+                        help='The eviction policy of the cache. The default '
+                        'is lru.')
+    parser.add_argument('--cache_min_hit_rate', type=float, required=False,
+                        default=0.05,
+                        help='The cache disables itself when its hit rate '
+                        'after 10000 lookups is below this fraction, 0 keeps '
+                        'it enabled. The default is 0.05.')
+    parser.set_defaults(func=run_modifier)
+
+    subparsers = parser.add_subparsers(title='commands', metavar='command')
+
+    export_parser = subparsers.add_parser(
+        'export', help='Writes the CDS, protein or mRNA sequence of every '
+        'transcript to a FASTA file.')
+    export_parser.add_argument('--gff_path', type=str, required=True,
+                               help='A file path to the gff file.')
+    export_parser.add_argument('--fasta_path', type=str, required=True,
+                               help='A file path to the reference FASTA file.')
+    export_parser.add_argument('--kind', choices=('cds', 'protein', 'mrna'),
+                               default='protein',
+                               help='The kind of sequence to export. The '
+                               'default is protein.')
+    export_parser.add_argument('--output_path', type=str, required=False,
+                               default=None,
+                               help='A file path to output the FASTA file. '
+                               'Default output file is stdout.')
+    export_parser.add_argument('--transcript_types', type=str, default='mRNA',
+                               help='A comma separated list of the feature '
+                               'types to export. The default is mRNA.')
+    export_parser.add_argument('--table', type=int, default=1,
+                               help='The NCBI genetic code used to translate '
+                               'proteins. The default is 1.')
+    export_parser.add_argument('--line_length', type=int, default=None,
+                               help='Wrap sequences at this many characters. '
+                               'The default is no wrapping.')
+    export_parser.add_argument('--processes', type=int, default=None,
+                               help='The number of worker processes. The '
+                               'default is the number of CPUs.')
+    export_parser.set_defaults(func=run_export)
+
+    stats_parser = subparsers.add_parser(
+        'stats', help='Writes the GC content, N content and soft-masked '
+        'fraction of every feature as a table.')
+    stats_parser.add_argument('--gff_path', type=str, required=True,
+                              help='A file path to the gff file.')
+    stats_parser.add_argument('--fasta_path', type=str, required=True,
+                              help='A file path to the soft-masked reference '
+                              'FASTA file.')
+    stats_parser.add_argument('--types', type=str, default='gene,exon',
+                              help='A comma separated list of the feature '
+                              'types to include, empty for all features. The '
+                              'default is gene,exon.')
+    stats_parser.add_argument('--format', choices=('tsv', 'parquet'),
+                              default='tsv',
+                              help='The output table format. The default is '
+                              'tsv, parquet requires pyarrow.')
+    stats_parser.add_argument('--output_path', type=str, required=False,
+                              default=None,
+                              help='A file path to output the table. Default '
+                              'output file is stdout.')
+    stats_parser.set_defaults(func=run_stats)
+
+    sort_parser = subparsers.add_parser(
+        'sort', help='Sorts a gff file by seqid and start with bounded memory, '
+        'keeping every gene block together.')
+    sort_parser.add_argument('--gff_path', type=str, required=True,
+                             help='A file path to the gff file.')
+    sort_parser.add_argument('--output_path', type=str, required=False,
+                             default=None,
+                             help='A file path to output the sorted gff file. '
+                             'Default output file is stdout.')
+    sort_parser.add_argument('--max_memory', type=int, default=512,
+                             help='The approximate memory, in MB, used to hold '
+                             'blocks before spilling them to disk. The default '
+                             'is 512.')
+    sort_parser.add_argument('--tmp_dir', type=str, default=None,
+                             help='The directory of the temporary files. The '
+                             'default is the system temporary directory.')
+    sort_parser.set_defaults(func=run_sort)
+
+    convert_parser = subparsers.add_parser(
+        'convert', help='Converts a gff file to GTF, BED12 or Parquet.')
+    convert_parser.add_argument('--gff_path', type=str, required=True,
+                                help='A file path to the gff file.')
+    convert_parser.add_argument('--format', choices=('gtf', 'bed12', 'parquet'),
+                                required=True,
+                                help='The output format, parquet requires '
+                                'pyarrow and writes every feature line.')
+    convert_parser.add_argument('--output_path', type=str, required=False,
+                                default=None,
+                                help='A file path to output the converted '
+                                'file. Default output file is stdout.')
+    convert_parser.add_argument('--transcript_types', type=str, default='mRNA',
+                                help='A comma separated list of the feature '
+                                'types written as GTF or BED12 transcripts. The '
+                                'default is mRNA.')
+    convert_parser.set_defaults(func=run_convert)
+
+    apply_delta_parser = subparsers.add_parser(
+        'apply-delta', help='Streams a gff file and adds the Dbxref values of '
+        'one or more delta files written with --emit delta. The lines keep '
+        'their file order and existing Dbxref values are kept, so the output '
+        'is equivalent, but not byte-identical, to --emit gff.')
+    apply_delta_parser.add_argument('--gff_path', type=str, required=True,
+                                    help='A file path to the gff file.')
+    apply_delta_parser.add_argument('--delta_path', type=str, action='append',
+                                    required=True,
+                                    help='A file path to a delta file, may be '
+                                    'given several times to stack deltas.')
+    apply_delta_parser.add_argument('--output_path', type=str, required=False,
+                                    default=None,
+                                    help='A file path to output the modified '
+                                    'gff file. Default output file is stdout.')
+    apply_delta_parser.set_defaults(func=run_apply_delta)
 
     args = parser.parse_args()
-    run_modifier(args)
+    if args.func is run_modifier and (args.gff_path is None or args.annotation is None):
+        parser.error('the following arguments are required: --gff_path, '
+                     '--annotation')
+    for annotation in (args.annotation or ()) if args.func is run_modifier else ():
+        if len(annotation) not in (3, 4):
+            parser.error('--annotation expects a path, index_col, ref_col and '
+                         'optionally processors, got {0} values'.format(
+                             len(annotation)))
+        if len(annotation) == 4:
+            unknown = [name for name in annotation[3].split(',')
+                       if name not in ACCESSION_PROCESSORS]
+            if unknown:
+                parser.error('unknown accession processor: {0}, choose from '
+                             '{1}'.format(', '.join(unknown),
+                                          ', '.join(ACCESSION_PROCESSORS)))
+    if getattr(args, 'feature_types', None) is not None:
+        args.feature_types = frozenset(args.feature_types.split(','))
+    if getattr(args, 'output_path', None) == '-':
+        args.output_path = None
+    if args.func is run_modifier and args.emit == 'delta' and args.propagate:
+        parser.error('--emit delta cannot be combined with --propagate, '
+                     'deltas are keyed by ID and propagated Dbxrefs may go to '
+                     'lines without one')
+    if args.func is run_modifier and args.gff_path == '-':
+        for option in ('chrom_sizes', 'sort', 'split_dir'):
+            if getattr(args, option) is not None:
+                parser.error('--{0} is not supported when streaming from '
+                             'stdin (--gff_path -)'.format(option))
+        if args.emit != 'gff' or args.propagate:
+            parser.error('--emit delta and --propagate are not supported when '
+                         'streaming from stdin (--gff_path -)')
+        if args.engine == 'join':
+            parser.error('--engine join is not supported when streaming from '
+                         'stdin (--gff_path -), the IDs are looked up one at a '
+                         'time')
+    args.func(args)
 
     exit(0)
 
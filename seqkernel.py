@@ -0,0 +1,283 @@
+"""
+Table-driven sequence kernels used for bulk sequence work on a parsed gff.
+
+Translation encodes every base as a 2-bit code (T=0, C=1, A=2, G=3) with NumPy
+and looks the resulting codon indices up in a precomputed table, so a whole CDS
+is translated with a handful of vectorised operations instead of one dict lookup
+and one string concatenation per codon. Reverse complementing is a single
+`bytes.translate` (or `str.translate`) pass over an IUPAC aware table followed by
+a C level reversal.
+
+The NCBI genetic codes are stored in the usual NCBI "ncbieaa" layout, i.e. the 64
+codons enumerated in TCAG order, the same layout as `gff3.AMINO_ACIDS`.
+"""
+
+import numpy as np
+
+__all__ = ['CodonTable', 'GENETIC_CODES', 'get_codon_table', 'translate',
+           'reverse_complement', 'complement', 'splice']
+
+BASES = 'TCAG'
+CODONS = [a + b + c for a in BASES for b in BASES for c in BASES]
+
+# id: (name, amino acids, start codons)
+GENETIC_CODES = {
+    1: ('Standard',
+        'FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+        ('TTG', 'CTG', 'ATG')),
+    2: ('Vertebrate Mitochondrial',
+        'FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSS**VVVVAAAADDEEGGGG',
+        ('ATT', 'ATC', 'ATA', 'ATG', 'GTG')),
+    3: ('Yeast Mitochondrial',
+        'FFLLSSSSYY**CCWWTTTTPPPPHHQQRRRRIIMMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+        ('ATA', 'ATG', 'GTG')),
+    4: ('Mold, Protozoan, and Coelenterate Mitochondrial and Mycoplasma/Spiroplasma',
+        'FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+        ('TTA', 'TTG', 'CTG', 'ATT', 'ATC', 'ATA', 'ATG', 'GTG')),
+    5: ('Invertebrate Mitochondrial',
+        'FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSSSSVVVVAAAADDEEGGGG',
+        ('TTG', 'ATT', 'ATC', 'ATA', 'ATG', 'GTG')),
+    6: ('Ciliate, Dasycladacean and Hexamita Nuclear',
+        'FFLLSSSSYYQQCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+        ('ATG',)),
+    9: ('Echinoderm and Flatworm Mitochondrial',
+        'FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNNKSSSSVVVVAAAADDEEGGGG',
+        ('ATG', 'GTG')),
+    10: ('Euplotid Nuclear',
+         'FFLLSSSSYY**CCCWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+         ('ATG',)),
+    11: ('Bacterial, Archaeal and Plant Plastid',
+         'FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+         ('TTG', 'CTG', 'ATT', 'ATC', 'ATA', 'ATG', 'GTG')),
+    12: ('Alternative Yeast Nuclear',
+         'FFLLSSSSYY**CC*WLLLSPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+         ('CTG', 'ATG')),
+    13: ('Ascidian Mitochondrial',
+         'FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSSGGVVVVAAAADDEEGGGG',
+         ('TTG', 'ATA', 'ATG', 'GTG')),
+    14: ('Alternative Flatworm Mitochondrial',
+         'FFLLSSSSYYY*CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNNKSSSSVVVVAAAADDEEGGGG',
+         ('ATG',)),
+    16: ('Chlorophycean Mitochondrial',
+         'FFLLSSSSYY*LCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+         ('ATG',)),
+    21: ('Trematode Mitochondrial',
+         'FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNNKSSSSVVVVAAAADDEEGGGG',
+         ('ATG', 'GTG')),
+    22: ('Scenedesmus obliquus Mitochondrial',
+         'FFLLSS*SYY*LCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+         ('ATG',)),
+    23: ('Thraustochytrium Mitochondrial',
+         'FF*LSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',
+         ('ATT', 'ATG', 'GTG')),
+}
+
+# 2-bit code of every byte, 4 marks anything that is not an unambiguous base
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate(BASES):
+    BASE_CODES[ord(_base)] = _code
+    BASE_CODES[ord(_base.lower())] = _code
+BASE_CODES[ord('U')] = BASE_CODES[ord('u')] = 0
+
+WHITESPACE = b' \t\r\n'
+
+IUPAC_FROM = b'ACGTUMRWSYKVHDBNacgtumrwsykvhdbn'
+IUPAC_TO = b'TGCAAKYWSRMBDHVNtgcaakywsrmbdhvn'
+COMPLEMENT_BYTES = bytes.maketrans(IUPAC_FROM, IUPAC_TO)
+COMPLEMENT_STR = str.maketrans(IUPAC_FROM.decode('ascii'),
+                               IUPAC_TO.decode('ascii'))
+
+
+class CodonTable(object):
+    """
+    A genetic code compiled for vectorised lookups.
+
+    Codons are indexed in base 5 (the four bases plus "anything else") so a
+    single gather maps every codon, including the ones containing ambiguous
+    bases, straight to an amino acid byte.
+    """
+
+    def __init__(self, table_id: int, name: str, amino_acids: str,
+                 start_codons: tuple, unknown: str = 'X'):
+        """
+        Creates a new codon table.
+
+        Parameters:
+            table_id:
+                The NCBI genetic code identifier.
+
+            name:
+                The NCBI name of the genetic code.
+
+            amino_acids:
+                The 64 amino acids of the code, codons enumerated in TCAG
+                order.
+
+            start_codons:
+                The codons that may initiate translation.
+
+            unknown:
+                The amino acid emitted for codons with ambiguous bases.
+        """
+
+        if len(amino_acids) != 64:
+            raise ValueError('Expecting 64 amino acids, got %d' %
+                             len(amino_acids))
+
+        self.table_id = table_id
+        self.name = name
+        self.amino_acids = amino_acids
+        self.start_codons = frozenset(start_codons)
+        self.stop_codons = frozenset(
+            codon for codon, amino_acid in zip(CODONS, amino_acids)
+            if amino_acid == '*')
+
+        lookup = np.full(125, ord(unknown), dtype=np.uint8)
+        for i, amino_acid in enumerate(amino_acids.encode('ascii')):
+            lookup[(i >> 4) * 25 + ((i >> 2) & 3) * 5 + (i & 3)] = amino_acid
+        self.lookup = lookup
+
+    def __repr__(self):
+        return 'CodonTable(%d, %r)' % (self.table_id, self.name)
+
+    def codon_indices(self, seq: bytes) -> np.ndarray:
+        """
+        Returns the base 5 index of every complete codon of seq.
+        """
+
+        n = len(seq) - len(seq) % 3
+        codes = BASE_CODES[np.frombuffer(seq, dtype=np.uint8, count=n)]
+        codes = codes.reshape(-1, 3)
+        return codes[:, 0] * 25 + codes[:, 1] * 5 + codes[:, 2]
+
+    def translate(self, seq, to_stop: bool = False) -> str:
+        """
+        Translates a nucleotide sequence, any trailing partial codon is
+        ignored.
+
+        Parameters:
+            seq:
+                The nucleotide sequence as a str or bytes, case insensitive.
+                Spaces and newlines are ignored.
+
+            to_stop:
+                If True, the translation stops before the first stop codon.
+
+        Returns:
+            Returns the peptide as a string.
+        """
+
+        if isinstance(seq, str):
+            seq = seq.encode('ascii')
+        seq = seq.translate(None, WHITESPACE)
+        peptide = self.lookup[self.codon_indices(seq)].tobytes()
+        if to_stop:
+            peptide = peptide.split(b'*', 1)[0]
+        return peptide.decode('ascii')
+
+    def translate_many(self, seqs) -> list:
+        """
+        Translates a batch of nucleotide sequences with a single table lookup,
+        the trailing partial codon of every sequence is ignored.
+
+        Parameters:
+            seqs:
+                A list of nucleotide sequences, all str or all bytes, without
+                whitespace.
+
+        Returns:
+            Returns the list of peptides as strings.
+        """
+
+        if not seqs:
+            return []
+
+        codon_counts = [len(seq) // 3 for seq in seqs]
+        joined = seqs[0][:0].join(
+            [seq[:3 * n] for seq, n in zip(seqs, codon_counts)])
+        if isinstance(joined, str):
+            joined = joined.encode('ascii')
+        peptides = self.lookup[self.codon_indices(joined)].tobytes().decode('ascii')
+
+        result, offset = [], 0
+        for n in codon_counts:
+            result.append(peptides[offset:offset + n])
+            offset += n
+        return result
+
+
+_codon_tables = {}
+
+
+def get_codon_table(table_id: int = 1) -> CodonTable:
+    """
+    Returns the compiled CodonTable for the given NCBI genetic code id.
+    """
+
+    try:
+        return _codon_tables[table_id]
+    except KeyError:
+        pass
+
+    try:
+        name, amino_acids, start_codons = GENETIC_CODES[table_id]
+    except KeyError:
+        raise ValueError('Unknown NCBI genetic code: %r, expecting one of %s' % (
+            table_id, ', '.join(str(k) for k in sorted(GENETIC_CODES))))
+
+    table = _codon_tables[table_id] = CodonTable(
+        table_id, name, amino_acids, start_codons)
+    return table
+
+
+def translate(seq, table: int = 1, to_stop: bool = False) -> str:
+    """
+    Translates seq with the given NCBI genetic code, see CodonTable.translate.
+    """
+
+    return get_codon_table(table).translate(seq, to_stop=to_stop)
+
+
+def complement(seq):
+    """
+    Returns the IUPAC complement of a str or bytes sequence, case is preserved.
+    """
+
+    if isinstance(seq, str):
+        return seq.translate(COMPLEMENT_STR)
+    return seq.translate(COMPLEMENT_BYTES)
+
+
+def reverse_complement(seq):
+    """
+    Returns the IUPAC reverse complement of a str or bytes sequence, case is
+    preserved.
+    """
+
+    return complement(seq)[::-1]
+
+
+def splice(seq, segments, strand: str = '+'):
+    """
+    Concatenates the given segments of seq and reverse complements the result
+    for the minus strand.
+
+    Parameters:
+        seq:
+            The reference sequence, a str or bytes.
+
+        segments:
+            A list of 1-based, inclusive (start, end) coordinates sorted by
+            start.
+
+        strand:
+            The strand of the spliced feature.
+
+    Returns:
+        Returns the spliced sequence in the same type as seq.
+    """
+
+    spliced = seq[:0].join([seq[start - 1:end] for start, end in segments])
+    if strand == '-':
+        spliced = reverse_complement(spliced)
+    return spliced
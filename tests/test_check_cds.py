@@ -0,0 +1,41 @@
+import io
+import logging
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gff3  # noqa: E402
+
+GFF = ('##gff-version 3\n'
+       'scf0\tEVM\tmRNA\t1\t9\t.\t+\t.\tID=mrna0\n'
+       'scf0\tEVM\tCDS\t1\t9\t.\t+\t0\tID=cds0;Parent=mrna0\n')
+
+
+def check_cds(seq: str, **kwargs) -> list:
+    gff = gff3.Gff3(gff_file=io.StringIO(GFF))
+    gff.check_cds(processes=1, reference={'scf0': {'seq': seq}}, **kwargs)
+    return [error['location'] for error in gff.features['mrna0'][0]['line_errors']
+            if error['error_type'] == 'CDS']
+
+
+class CheckCdsTest(unittest.TestCase):
+
+    def setUp(self):
+        gff3.logger.setLevel(logging.CRITICAL)
+
+    def test_atg_start(self):
+        self.assertEqual(check_cds('ATGAAATAA'), [])
+
+    def test_alternative_start_is_an_error_by_default(self):
+        self.assertEqual(check_cds('CTGAAATAA'), ['start_codon'])
+        self.assertEqual(check_cds('TTGAAATAA'), ['start_codon'])
+
+    def test_alternative_start_of_table(self):
+        self.assertEqual(check_cds('CTGAAATAA', start_codons=None), [])
+        self.assertEqual(check_cds('CTGAAATAA', start_codons=('atg', 'ctg')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import io
+import logging
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gff3  # noqa: E402
+
+GFF = ('##gff-version 3\n'
+       'scf0\tEVM\tgene\t1\t100\t.\t+\t.\tID=gene0\n'
+       'scf0\tEVM\tmRNA\t1\t100\t.\t+\t.\tID=mrna0;Parent=gene0\n')
+
+
+class Gff3WriteTest(unittest.TestCase):
+
+    def setUp(self):
+        gff3.logger.setLevel(logging.CRITICAL)
+        self.gff = gff3.Gff3(gff_file=io.StringIO(GFF))
+        self.gff.features['mrna0'][0]['attributes']['Note'] = 'edited'
+
+    def write(self, **kwargs) -> str:
+        out = io.StringIO()
+        self.gff.write(out, **kwargs)
+        return out.getvalue()
+
+    def test_default_writes_unmarked_edits(self):
+        self.assertIn('Note=edited', self.write())
+
+    def test_reuse_raw_needs_mark_modified(self):
+        self.assertNotIn('Note=edited', self.write(reuse_raw=True))
+        self.gff.mark_modified(self.gff.features['mrna0'][0])
+        self.assertIn('Note=edited', self.write(reuse_raw=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
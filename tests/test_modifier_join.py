@@ -0,0 +1,79 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modmygff import Modifier  # noqa: E402
+
+ROWS = [
+    ('g1.m1', 'sp|P00001|A_HUMAN'),
+    ('g1.m1', 'PF00001.1'),
+    ('g1.m1', 'PF00001.1'),
+    ('g1.m2', 'NA'),
+    ('g1.m2', 'XX12345'),
+    ('g2', 'PF00002.1'),
+    ('g3.m1', 'tr|Q00003|B_YEAST'),
+    ('g3.m1.x', 'PF00003.1'),
+]
+
+
+def feature_ids(n_genes: int) -> list:
+
+    ids = []
+    for i in range(n_genes):
+        ids.extend(['g%d' % i, 'g%d.m1' % i, 'g%d.m2' % i, 'cds.g%d.m1' % i,
+                    'g%d.m1.exon1' % i, 'g%d.m2.exon1' % i])
+    return ids
+
+
+class ModifierJoinTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.anno_path = os.path.join(self.tmp_dir.name, 'anno.tsv')
+        rows = ROWS + [('g%d.m1' % i, 'PF%05d.1' % (i % 7))
+                       for i in range(4, 150)]
+        with open(self.anno_path, 'w') as anno_f:
+            for ID, ref in rows:
+                anno_f.write('{0}\t{1}\n'.format(ID, ref))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def modifiers(self, **kwargs):
+        anno_file = [(self.anno_path, 0, 1)]
+        return (Modifier(anno_file),
+                Modifier(anno_file, engine='join', tmp_dir=self.tmp_dir.name,
+                         **kwargs))
+
+    def assert_same(self, hash_modifier, join_modifier):
+        ids = feature_ids(160)
+        self.assertEqual(join_modifier.resolve(ids), hash_modifier.resolve(ids))
+        self.assertEqual(join_modifier.sources[0].num_dots,
+                         hash_modifier.sources[0].num_dots)
+        self.assertEqual(join_modifier.unhandled, hash_modifier.unhandled)
+
+    def test_join_matches_hash(self):
+        self.assert_same(*self.modifiers())
+
+    def test_join_spilled_to_disk(self):
+        # one run file per row, more than gffsort.MAX_OPEN_RUNS
+        hash_modifier, join_modifier = self.modifiers(max_memory=1)
+        self.assertIsNotNone(join_modifier.sources[0]._table_path)
+        self.assert_same(hash_modifier, join_modifier)
+
+    def test_get(self):
+        hash_modifier, join_modifier = self.modifiers()
+        self.assertEqual(join_modifier.lookup('cds.g1.m1'),
+                         hash_modifier.lookup('cds.g1.m1'))
+        self.assertEqual(join_modifier.lookup('g9'), [])
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            Modifier([(self.anno_path, 0, 1)], engine='merge')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import io
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modmygff import stream_gff  # noqa: E402
+
+
+def gff_text(n_lines: int) -> str:
+
+    return ''.join('scf0\tEVM\tmRNA\t%d\t%d\t.\t+\t.\tID=mrna%d\n' % (
+        i + 1, i + 100, i) for i in range(n_lines))
+
+
+class StreamGffTest(unittest.TestCase):
+
+    def run_with_timeout(self, func, timeout: float = 10):
+        result = {}
+
+        def target():
+            try:
+                result['value'] = func()
+            except BaseException as e:
+                result['error'] = e
+
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        thread.join(timeout)
+        self.assertFalse(thread.is_alive(), 'stream_gff did not return')
+        return result
+
+    def test_annotates_feature_lines(self):
+        out = io.StringIO()
+        count = stream_gff(io.StringIO('##gff-version 3\n' + gff_text(3)), out,
+                           lambda ID: ['PFAM:PF00001.1'] if ID == 'mrna1' else None)
+
+        self.assertEqual(count, 1)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], '##gff-version 3')
+        self.assertTrue(lines[2].endswith('ID=mrna1;Dbxref=PFAM:PF00001.1'))
+        self.assertTrue(lines[3].endswith('ID=mrna2'))
+
+    def test_crlf_input(self):
+        looked_up = []
+
+        def lookup(ID):
+            looked_up.append(ID)
+            return ['PFAM:PF00001.1'] if ID == 'mrna1' else None
+
+        out = io.StringIO()
+        text = gff_text(3).replace('\n', '\r\n')
+        count = stream_gff(io.StringIO(text, newline=''), out, lookup)
+
+        self.assertEqual(count, 1)
+        self.assertEqual(looked_up, ['mrna0', 'mrna1', 'mrna2'])
+        lines = out.getvalue().split('\n')
+        self.assertTrue(lines[1].endswith('ID=mrna1;Dbxref=PFAM:PF00001.1\r'))
+        self.assertEqual(out.getvalue().count('\r\n'), 3)
+
+    def test_lookup_error_does_not_hang(self):
+        def lookup(ID):
+            raise ValueError(ID)
+
+        result = self.run_with_timeout(lambda: stream_gff(
+            io.StringIO(gff_text(20000)), io.StringIO(), lookup,
+            queue_size=2, chunk_size=100))
+
+        self.assertIsInstance(result.get('error'), ValueError)
+
+    def test_write_error_is_raised(self):
+        looked_up = []
+
+        class FailingOut(io.StringIO):
+            def write(self, data):
+                raise BrokenPipeError('closed')
+
+        result = self.run_with_timeout(lambda: stream_gff(
+            io.StringIO(gff_text(20000)), FailingOut(), looked_up.append,
+            queue_size=2, chunk_size=100))
+
+        self.assertIsInstance(result.get('error'), BrokenPipeError)
+        # the annotating thread stops soon after the writer failed
+        self.assertLess(len(looked_up), 2000)
+
+
+if __name__ == '__main__':
+    unittest.main()